@@ -0,0 +1,240 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from drum_beat import Kick, HiHat, OpenHat, GenerateBeat, Pattern, VoiceBank, Reverb, Reverb_apply, ConvolutionReverb
+
+
+def reference_apply_reverb(signal, delay, wet, reverb):
+    """The original per-sample reverb loop, kept as a baseline for comparison."""
+    buffer = Reverb(delay)
+    out_signal = []
+    for i, s in enumerate(signal):
+        if i < delay:
+            sdelay = 0
+        else:
+            sdelay = buffer.dequeue()
+        out_signal.append((1 - wet) * s + wet * sdelay)
+        buffer.enqueue((1 - reverb) * s + reverb * sdelay)
+    return np.array(out_signal)
+
+
+def time_call(function, *args, repeat=3):
+    """Return the best wall time of `repeat` calls and the last result."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(function, *args):
+    """Return the peak memory traced by tracemalloc while `function` runs, in bytes."""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class BenchmarkSuite:
+    """
+     A benchmark suite covering the synthesis, sequencing and effect hot paths.
+
+     Every stage is swept over durations, sample rates, pattern lengths or
+     repetition counts. Each case records its best wall time, real-time factor
+     (audio seconds per wall second) and peak traced memory. Results can be
+     saved as JSON and compared against an earlier run to flag regressions.
+     Nothing here touches an audio device.
+
+     Attributes:
+         repeat (int): Number of timed calls per case, the best one is kept.
+         durations (tuple): Hit durations in milliseconds for the synthesis stages.
+         sample_rates (tuple): Sample rates for the synthesis stages.
+         steps (tuple): Pattern lengths for the sequencing and effect stages.
+         repetitions (tuple): Repetition counts for the sequencing and effect stages.
+
+     Methods:
+         run(): Run every stage and return the results.
+         compare(results, baseline, threshold): Return the cases that got slower than the baseline.
+     """
+
+    sample_rate = 44100
+    duration = 150
+    batch_hits = 128
+    seed = 0
+
+    def __init__(self, repeat=3, durations=(50, 150, 500), sample_rates=(22050, 44100, 96000),
+                 steps=(8, 16, 64), repetitions=(1, 4, 16)):
+        """Initialize the suite with the values to sweep."""
+        self.repeat = repeat
+        self.durations = durations
+        self.sample_rates = sample_rates
+        self.steps = steps
+        self.repetitions = repetitions
+
+    def measure(self, stage, params, audio_seconds, function, *args):
+        """Time one case and return its result record."""
+        seconds, _ = time_call(function, *args, repeat=self.repeat)
+        return {
+            'stage': stage,
+            'params': params,
+            'seconds': seconds,
+            'audio_seconds': audio_seconds,
+            'real_time_factor': audio_seconds / seconds,
+            'peak_bytes': peak_memory(function, *args),
+        }
+
+    def synthesis_cases(self):
+        """Sweep the instrument synthesis, single hits and a 128-hit kick batch, over durations and sample rates."""
+        for sample_rate in self.sample_rates:
+            for duration in self.durations:
+                params = {'duration': duration, 'sample_rate': sample_rate}
+                audio_seconds = duration / 1000
+                yield self.measure('generate_kick_sound', params, audio_seconds,
+                                   Kick(sample_rate).generate_kick_sound, 30, duration)
+                yield self.measure('generate_hi_hat', params, audio_seconds,
+                                   HiHat(sample_rate).generate_hi_hat, duration)
+                yield self.measure('generate_open_hat', params, audio_seconds,
+                                   OpenHat(sample_rate).generate_open_hat, duration)
+                yield self.measure('generate_kick_sound_batch', dict(params, hits=self.batch_hits),
+                                   self.batch_hits * audio_seconds, Kick(sample_rate).generate_kick_sound,
+                                   np.linspace(25, 60, self.batch_hits), duration)
+
+    def generate_sound_cases(self):
+        """Sweep GenerateBeat.generate_sound over repetitions, with a warm and a cold voice bank."""
+        for repetition in self.repetitions:
+            params = {'repetition': repetition, 'seed': self.seed}
+            # A fixed seed times the same pattern on every run, and its audio length is measured, not estimated.
+            generate_beat = GenerateBeat(repetition, seed=self.seed)
+            audio_seconds = sum(len(beat) for beat in generate_beat.generate_sound()) / self.sample_rate
+            yield self.measure('generate_sound', params, audio_seconds, generate_beat.generate_sound)
+            cold_beat = lambda: GenerateBeat(repetition, seed=self.seed, voice_bank=VoiceBank()).generate_sound()
+            yield self.measure('generate_sound_cold', params, audio_seconds, cold_beat)
+
+    def sequencing_cases(self):
+        """Sweep the sequencer, panning_mixture and both reverbs over pattern lengths and repetitions."""
+        voices = [Kick().generate_kick_sound(30, self.duration) for _ in range(6)]
+        step_length = len(voices[0])
+        rng = np.random.default_rng(0)
+        for steps in self.steps:
+            pattern = Pattern.random(6, steps, rng=rng)
+            sequences = [np.where(hits[:, np.newaxis], voice, 0).reshape(-1)
+                         for voice, hits in zip(voices, pattern.hits)]
+            for repetition in self.repetitions:
+                params = {'steps': steps, 'repetition': repetition}
+                audio_seconds = steps * step_length * repetition / self.sample_rate
+                generate_beat = GenerateBeat(repetition)
+                tracks = list(zip(voices, pattern.hits))
+                yield self.measure('sequencer', params, audio_seconds,
+                                   generate_beat.mix_tracks, tracks, step_length, steps)
+                yield self.measure('panning_mixture', params, audio_seconds,
+                                   generate_beat.panning_mixture, sequences)
+                beat = generate_beat.mix_tracks(tracks, step_length, steps)
+                yield self.measure('apply_reverb', params, audio_seconds,
+                                   Reverb_apply.apply_reverb, beat, 100, 0.5, 0.1)
+                yield self.measure('convolution_reverb', params, audio_seconds,
+                                   ConvolutionReverb.synthetic(seed=0).process, beat)
+
+    def run(self):
+        """Run every stage and return the results with a description of the environment."""
+        cases = []
+        for stage_cases in (self.synthesis_cases(), self.generate_sound_cases(), self.sequencing_cases()):
+            for case in stage_cases:
+                print(format_case(case), flush=True)
+                cases.append(case)
+        return {'commit': current_commit(), 'python': sys.version.split()[0], 'numpy': np.__version__,
+                'machine': platform.platform(), 'cases': cases}
+
+    @staticmethod
+    def compare(results, baseline, threshold=0.2):
+        """Return (case, baseline seconds) for every case more than `threshold` slower than in the baseline."""
+        baseline_cases = {case_key(case): case for case in baseline['cases']}
+        regressions = []
+        for case in results['cases']:
+            old = baseline_cases.get(case_key(case))
+            if old is not None and case['seconds'] > old['seconds'] * (1 + threshold):
+                regressions.append((case, old['seconds']))
+        return regressions
+
+
+def case_key(case):
+    """Identify a case by its stage and parameters."""
+    return case['stage'], tuple(sorted(case['params'].items()))
+
+
+def format_case(case):
+    """Format a result record as one line of the report."""
+    params = ' '.join(f"{name}={value}" for name, value in case['params'].items())
+    return (f"{case['stage']:<20} {params:<32} {case['seconds'] * 1000:>10.3f} ms "
+            f"{case['real_time_factor']:>10.1f}x {case['peak_bytes'] / 2 ** 20:>9.2f} MiB")
+
+
+def current_commit():
+    """Return the git commit of the working tree, or None outside a repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_reverb(repetitions=(1, 2, 4), sample_rate=44100, delay=100, wet=0.5, reverb=0.1):
+    """Compare the block reverb with the per-sample reference on generated beats."""
+    print(f"{'reps':>5} {'samples':>9} {'audio s':>8} {'loop s':>9} {'block s':>9} {'speedup':>8} {'max err':>9}")
+    for repetition in repetitions:
+        beat, _ = GenerateBeat(repetition=repetition).generate_sound()
+        audio_seconds = len(beat) / sample_rate
+        loop_time, expected = time_call(reference_apply_reverb, beat, delay, wet, reverb, repeat=1)
+        block_time, actual = time_call(Reverb_apply.apply_reverb, beat, delay, wet, reverb)
+        error = np.max(np.abs(expected - actual))
+        print(f"{repetition:>5} {len(beat):>9} {audio_seconds:>8.2f} {loop_time:>9.4f} {block_time:>9.4f} "
+              f"{loop_time / block_time:>7.0f}x {error:>9.2e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the synthesis, sequencing and effect stages.")
+    parser.add_argument("--quick", action="store_true", help="run a reduced sweep")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per case")
+    parser.add_argument("--save", metavar="FILE", help="write the results to a JSON file")
+    parser.add_argument("--compare", metavar="FILE", help="flag cases that got slower than in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a case is flagged")
+    parser.add_argument("--reverb-reference", action="store_true",
+                        help="compare the block reverb with the original per-sample loop instead")
+    args = parser.parse_args(argv)
+
+    if args.reverb_reference:
+        benchmark_reverb()
+        return 0
+
+    if args.quick:
+        suite = BenchmarkSuite(repeat=args.repeat, durations=(150,), sample_rates=(44100,), steps=(8, 64),
+                               repetitions=(1, 8))
+    else:
+        suite = BenchmarkSuite(repeat=args.repeat)
+    results = suite.run()
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = BenchmarkSuite.compare(results, baseline, args.threshold)
+        for case, old_seconds in regressions:
+            print(f"REGRESSION {format_case(case)} (was {old_seconds * 1000:.3f} ms)")
+        print(f"{len(regressions)} regressions against {baseline.get('commit') or args.compare}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,172 @@
+import hashlib
+import inspect
+import json
+import os
 import random
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict
 import numpy as np
-import sounddevice as sd
-from scipy.signal import butter, sosfilt
+from scipy.signal import butter, sosfilt, lfilter
 from scipy.io import wavfile
+from profiling import carry, span
+
+
+class FilterRegistry:
+    """
+       A shared registry of Butterworth filter designs.
+
+       Each second-order-sections design is computed once per
+       (order, cutoff, type, fs) and kept, so synthesizing a hit no longer
+       redesigns the same filters. Designs are shared between callers and must
+       not be modified in place.
+
+       Methods:
+           design(order, cutoff, btype, fs): Return the SOS design of a filter.
+           create(order, cutoff, btype, fs): Return a stateful filter for chunked processing.
+       """
+
+    btype_aliases = {
+        'low': 'lowpass', 'lp': 'lowpass', 'lowpass': 'lowpass',
+        'high': 'highpass', 'hp': 'highpass', 'highpass': 'highpass',
+        'band': 'bandpass', 'bp': 'bandpass', 'bandpass': 'bandpass',
+        'bs': 'bandstop', 'stop': 'bandstop', 'bandstop': 'bandstop',
+    }
+
+    def __init__(self):
+        self.designs = {}
+        self.lock = threading.Lock()
+
+    def design(self, order, cutoff, btype, fs):
+        cutoff = tuple(np.atleast_1d(cutoff).tolist())
+        key = (order, cutoff, self.btype_aliases[btype], fs)
+        sos = self.designs.get(key)
+        if sos is None:
+            sos = butter(order, cutoff if len(cutoff) > 1 else cutoff[0], key[2], fs=fs, output='sos')
+            with self.lock:
+                sos = self.designs.setdefault(key, sos)
+        return sos
+
+    def create(self, order, cutoff, btype, fs):
+        return SOSFilter(self.design(order, cutoff, btype, fs))
+
+
+class SOSFilter:
+    """
+       A second-order-sections filter that keeps its state between calls.
+
+       Filtering a signal in consecutive chunks gives the same result as
+       filtering it in one call, so voices can be synthesized chunk by chunk
+       without discontinuities at the chunk boundaries.
+
+       Attributes:
+           sos (ndarray): The filter design.
+           axis (int): The axis of the signal to filter along.
+           zi (ndarray): The filter state, or None before the first chunk.
+
+       Methods:
+           process(chunk): Filter the next chunk of a signal.
+           reset(): Return the filter to its initial, silent state.
+       """
+
+    def __init__(self, sos, axis=-1):
+        self.sos = sos
+        self.axis = axis
+        self.zi = None
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk)
+        if self.zi is None:
+            shape = list(chunk.shape)
+            shape[self.axis] = 2
+            self.zi = np.zeros([self.sos.shape[0]] + shape)
+        filtered, self.zi = sosfilt(self.sos, chunk, axis=self.axis, zi=self.zi)
+        return filtered
+
+    def reset(self):
+        self.zi = None
+
+
+filter_registry = FilterRegistry()
+
+
+class HitBatch:
+    """
+       The shared sample grid of a batch of instrument hits.
+
+       Every instrument accepts a scalar or an array for each of its parameters.
+       The parameters are broadcast against each other and every element becomes
+       one hit, a row of the batch. The number of samples of a hit is
+       floor(sample_rate / 1000 * duration), unless the instrument passes its own
+       sample_count(sample_rate, duration). Rows are padded with silence to the longest
+       hit, so a whole kit of variants is synthesized and filtered in one pass.
+       A call with scalars only is a batch of one hit and returns a 1-D voice, as
+       it always has. Hits of the same duration draw their noise exactly like
+       consecutive single calls would.
+
+       Attributes:
+           shape (tuple): Broadcast shape of the parameters, () for a single hit.
+           values (list): The duration and parameters of every hit, to pass on to other instrument methods.
+           columns (list): The duration and parameters as (hits, 1) columns, to broadcast against the grid.
+           counts (ndarray): Number of samples of every hit.
+           length (int): Number of samples of the longest hit.
+           mask (ndarray): Which samples of the grid belong to their hit.
+
+       Methods:
+           linspace(start, stop): Return evenly spaced values over the samples of every hit, like np.linspace.
+           uniform(*values): Return whether every element of every value is the same.
+           seconds(): Return the time of every sample, in seconds.
+           random(rng): Return uniform noise in [0, 1) for every hit.
+           normal(rng, loc, scale): Return gaussian noise for every hit.
+           finish(signal): Silence the padding and shape the batch like the parameters.
+       """
+
+    def __init__(self, sample_rate, duration, *params, sample_count=None):
+        values = np.broadcast_arrays(duration, *params)
+        self.sample_rate = sample_rate
+        self.shape = values[0].shape
+        flat = [np.ravel(value) for value in values]
+        self.values = flat if self.shape else [value[0] for value in flat]
+        self.columns = [value[:, np.newaxis] for value in flat]
+        if sample_count is None:
+            self.counts = np.floor((sample_rate / 1000) * flat[0]).astype(int)
+        else:
+            self.counts = np.asarray(sample_count(sample_rate, flat[0])).astype(int)
+        self.length = int(self.counts.max()) if self.counts.size else 0
+        self.mask = np.arange(self.length) < self.counts[:, np.newaxis]
+
+    def linspace(self, start, stop):
+        counts = self.counts[:, np.newaxis]
+        shared = self.uniform(counts, start, stop)
+        if shared:
+            # Every hit shares the grid, so it is computed once and broadcast against the batch.
+            counts = counts[:1]
+            start, stop = (value[:1] if np.ndim(value) else value for value in (start, stop))
+        step = np.subtract(stop, start, dtype=float) / np.maximum(counts - 1, 1)
+        grid = np.arange(self.length, dtype=float) * step + start
+        rows = np.flatnonzero(counts[:, 0] > 1)
+        grid[rows, counts[rows, 0] - 1] = np.broadcast_to(stop, counts.shape)[rows, 0]
+        if not shared:
+            # Hold the padding of shorter hits at `stop`, rather than running past it, e.g. below zero.
+            grid = np.where(self.mask, grid, stop)
+        return grid
+
+    @staticmethod
+    def uniform(*values):
+        return all(np.all(value == np.ravel(value)[0]) for value in values if np.size(value))
+
+    def seconds(self):
+        return np.arange(self.length) / self.sample_rate
+
+    def random(self, rng):
+        return rng.random((len(self.counts), self.length))
+
+    def normal(self, rng, loc, scale):
+        return rng.normal(loc, scale, (len(self.counts), self.length))
+
+    def finish(self, signal):
+        return np.where(self.mask, signal, 0).reshape(self.shape + (self.length,))
 
 
 class Kick:
@@ -11,23 +175,33 @@ class Kick:
 
      Attributes:
          sample_rate (int): The sample rate of the sound.
+         rng (Generator): Accepted like for every instrument, the kick uses no noise.
 
      Methods:
-         generate_kick_sound(frequency, duration): Generate a kick drum sound.
+         generate_kick_sound(frequency, duration, velocity): Generate a kick drum sound, or a batch of them.
+         sample_count(sample_rate, duration): Return the number of samples of a kick.
      """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
-    def generate_kick_sound(self, frequency, duration):
-        time = np.linspace(0, 1, int(self.sample_rate * duration / 1000))
+    @staticmethod
+    def sample_count(sample_rate, duration):
+        # The kick has always scaled the rate before dividing, which can give one sample less for fractional durations.
+        return np.floor(sample_rate * np.asarray(duration) / 1000)
+
+    def generate_kick_sound(self, frequency, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, frequency, velocity, sample_count=self.sample_count)
+        _, frequency, velocity = hits.columns
+        time = hits.linspace(0, 1)
         exponential_decay = np.power(0.5, 25 * time)
         envelope = frequency * np.sqrt(time) - 0.15
         oscillation = exponential_decay * np.cos(envelope)
-        sos = butter(2, 300, 'low', fs=self.sample_rate, output='sos')
+        sos = filter_registry.design(2, 300, 'low', fs=self.sample_rate)
         filtered = sosfilt(sos, oscillation)
-        kick_sound = filtered * 10
-        return kick_sound
+        kick_sound = filtered * 10 * velocity
+        return hits.finish(kick_sound)
 
 
 class Snare:
@@ -36,44 +210,50 @@ class Snare:
 
     Attributes:
         sample_rate (int): The sample rate of the sound.
+        rng (Generator): Source of the noise, the global numpy random state unless given.
 
     Methods:
         generate_noise(duration): Generate noise for the snare.
         generate_sine(frequency, duration): Generate a sine wave for the snare.
         create_filter(): Create filters for processing snare sounds.
-        generate_snare_sound(frequency, duration): Generate a snare drum sound.
+        generate_snare_sound(frequency, duration, velocity): Generate a snare drum sound, or a batch of them.
     """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_noise(self, duration):
-        time = np.linspace(0, 1, int((self.sample_rate / 1000) * duration))
-        noise = np.random.random_sample(int((self.sample_rate / 1000) * duration)) * 2 - 1
+        hits = HitBatch(self.sample_rate, duration)
+        time = hits.linspace(0, 1)
+        noise = hits.random(self.rng) * 2 - 1
         envelope = np.power(0.5, 12.5 * time)
-        return noise * envelope
+        return hits.finish(noise * envelope)
 
     def generate_sine(self, frequency, duration):
-        num_samples = int((self.sample_rate / 1000) * duration)
-        normalized_time = np.linspace(0, duration / 1000, num_samples)
+        hits = HitBatch(self.sample_rate, duration, frequency)
+        duration, frequency = hits.columns
+        normalized_time = hits.linspace(0, duration / 1000)
         envelope = np.power(0.5, 25 * normalized_time)
-        actual_time = np.arange(num_samples) / self.sample_rate
+        actual_time = hits.seconds()
         oscillation = 1 * np.sin(2 * np.pi * frequency * actual_time) * envelope
-        return oscillation
+        return hits.finish(oscillation)
 
     def create_filter(self):
-        sos_high_pass = butter(4, 20, 'hp', fs=1000, analog=False, output='sos')
-        sos_band_pass = butter(1, [5, 40], 'bp', fs=1000, output='sos')
+        sos_high_pass = filter_registry.design(4, 20, 'hp', fs=1000)
+        sos_band_pass = filter_registry.design(1, [5, 40], 'bp', fs=1000)
         return sos_high_pass, sos_band_pass
 
-    def generate_snare_sound(self, frequency, duration):
+    def generate_snare_sound(self, frequency, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, frequency, velocity)
+        duration, frequency, _ = hits.values
         noise = self.generate_noise(duration)
         sine = self.generate_sine(frequency, duration)
         sos_high_pass, sos_band_pass = self.create_filter()
         filtered_noise = sosfilt(sos_high_pass, noise)
         filtered_sine = sosfilt(sos_band_pass, sine)
-        snare_sound = (filtered_noise + filtered_sine) * 4
-        return snare_sound
+        snare_sound = (filtered_noise + filtered_sine) * 4 * hits.columns[2]
+        return hits.finish(snare_sound)
 
 
 class HiHat:
@@ -82,43 +262,50 @@ class HiHat:
 
      Attributes:
          sample_rate (int): The sample rate of the sound.
+         rng (Generator): Source of the noise, the global numpy random state unless given.
 
      Methods:
          generate_noise(duration): Generate noise for the hi-hat.
          generate_square_tone(frequency, duration): Generate a square tone for the hi-hat.
          create_filter(): Create filters for processing hi-hat sounds.
-         generate_hi_hat(duration): Generate a hi-hat sound.
+         generate_hi_hat(duration, velocity): Generate a hi-hat sound, or a batch of them.
      """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_noise(self, duration):
-        noise = np.random.random_sample(int((self.sample_rate / 1000) * duration))
-        return noise
+        hits = HitBatch(self.sample_rate, duration)
+        noise = hits.random(self.rng)
+        return hits.finish(noise)
 
     def generate_square_tone(self, frequency, duration):
-        time = np.linspace(0, 1, int((self.sample_rate / 1000) * duration))
+        hits = HitBatch(self.sample_rate, duration, frequency)
+        _, frequency = hits.columns
+        time = hits.linspace(0, 1)
         envelope = np.power(0.5, 25 * time)
         oscillation = np.sin(2 * np.pi * frequency * time)
         square_tone = np.where(oscillation > 0, 1, -1) * envelope
-        return square_tone
+        return hits.finish(square_tone)
 
     def create_filter(self):
-        sos_high_pass_1 = butter(10, 100, 'hp', fs=1000, analog=False, output='sos')
-        sos_high_pass_2 = butter(2, 100, 'hp', fs=1000, analog=False, output='sos')
+        sos_high_pass_1 = filter_registry.design(10, 100, 'hp', fs=1000)
+        sos_high_pass_2 = filter_registry.design(2, 100, 'hp', fs=1000)
         return sos_high_pass_1, sos_high_pass_2
 
-    def generate_hi_hat(self, duration):
-        time = np.linspace(1, 0, int((self.sample_rate / 1000) * duration))
+    def generate_hi_hat(self, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, velocity)
+        duration, velocity = hits.values[0], hits.columns[1]
+        time = hits.linspace(1, 0)
         time = np.power(time, 4)
         high_noise = self.generate_square_tone(350, duration) + self.generate_square_tone(800, duration) + \
                      (self.generate_noise(duration) / 4)
         sos_high_pass_1, sos_high_pass_2 = self.create_filter()
         filtered_wave_1 = sosfilt(sos_high_pass_1, high_noise)
         filtered_wave_2 = sosfilt(sos_high_pass_2, filtered_wave_1)
-        hi_hat_sound = filtered_wave_2 * time * 4
-        return hi_hat_sound
+        hi_hat_sound = filtered_wave_2 * time * 4 * velocity
+        return hits.finish(hi_hat_sound)
 
 
 class OpenHat:
@@ -127,43 +314,50 @@ class OpenHat:
 
       Attributes:
           sample_rate (int): The sample rate of the sound.
+          rng (Generator): Source of the noise, the global numpy random state unless given.
 
       Methods:
           generate_noise(duration): Generate noise for the open hi-hat.
           generate_square_tone(frequency, duration): Generate a square tone for the open hi-hat.
           create_filter(): Create filters for processing open hi-hat sounds.
-          generate_open_hat(duration): Generate an open hi-hat sound.
+          generate_open_hat(duration, velocity): Generate an open hi-hat sound, or a batch of them.
       """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_noise(self, duration):
-        noise = np.random.random_sample(int((self.sample_rate / 1000) * duration))
-        return noise
+        hits = HitBatch(self.sample_rate, duration)
+        noise = hits.random(self.rng)
+        return hits.finish(noise)
 
     def generate_square_tone(self, frequency, duration):
-        time = np.linspace(0, 1, int((self.sample_rate / 1000) * duration))
+        hits = HitBatch(self.sample_rate, duration, frequency)
+        _, frequency = hits.columns
+        time = hits.linspace(0, 1)
         envelope = np.power(0.5, 25 * time)
         oscillation = np.sin(2 * np.pi * frequency * time)
         square_tone = np.where(oscillation > 0, 1, -1) * envelope
-        return square_tone
+        return hits.finish(square_tone)
 
     def create_filter(self):
-        sos_high_pass_1 = butter(10, 50, 'hp', fs=1000, analog=False, output='sos')
-        sos_high_pass_2 = butter(2, 50, 'hp', fs=1000, analog=False, output='sos')
+        sos_high_pass_1 = filter_registry.design(10, 50, 'hp', fs=1000)
+        sos_high_pass_2 = filter_registry.design(2, 50, 'hp', fs=1000)
         return sos_high_pass_1, sos_high_pass_2
 
-    def generate_open_hat(self, duration):
-        time = np.linspace(1, 0, int((self.sample_rate / 1000) * duration))
+    def generate_open_hat(self, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, velocity)
+        duration, velocity = hits.values[0], hits.columns[1]
+        time = hits.linspace(1, 0)
         time = np.power(time, 0.1)
         high_noise = self.generate_square_tone(350, duration) + self.generate_square_tone(800, duration) + \
                      (self.generate_noise(duration) / 4)
         sos_high_pass_1, sos_high_pass_2 = self.create_filter()
         filtered_wave_1 = sosfilt(sos_high_pass_1, high_noise)
         filtered_wave_2 = sosfilt(sos_high_pass_2, filtered_wave_1)
-        open_hat_sound = filtered_wave_2 * time * 4
-        return open_hat_sound
+        open_hat_sound = filtered_wave_2 * time * 4 * velocity
+        return hits.finish(open_hat_sound)
 
 
 class WoodBlock:
@@ -172,29 +366,38 @@ class WoodBlock:
 
        Attributes:
            sample_rate (int): The sample rate of the sound.
+           rng (Generator): Accepted like for every instrument, the woodblock uses no noise.
 
        Methods:
            generate_a_wave(frequency, duration): Generate a sine wave.
-           generate_woodblock(frequency, ratio, amount, duration): Generate a woodblock sound.
+           generate_woodblock(frequency, ratio, amount, duration, velocity): Generate a woodblock sound, or a batch
+               of them.
        """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_a_wave(self, frequency, duration):
-        normalized_time = np.linspace(0, 1, int((self.sample_rate / 1000) * duration))
+        hits = HitBatch(self.sample_rate, duration, frequency)
+        _, frequency = hits.columns
+        normalized_time = hits.linspace(0, 1)
         envelope = np.power(0.5, 25 * normalized_time)
-        actual_time = np.arange(int((self.sample_rate / 1000) * duration)) / self.sample_rate
+        actual_time = hits.seconds()
         oscillation = np.sin(2 * np.pi * frequency * actual_time)
-        return envelope * oscillation
-
-    def generate_woodblock(self, frequency, ratio, amount, duration):
-        frequency_modulation = frequency + self.generate_a_wave(frequency * ratio, duration) * amount
-        normalized_time = np.linspace(0, 1, int((self.sample_rate / 1000) * duration))
+        return hits.finish(envelope * oscillation)
+
+    def generate_woodblock(self, frequency, ratio, amount, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, frequency, ratio, amount, velocity)
+        duration, frequency, ratio, _, _ = hits.values
+        modulator = self.generate_a_wave(frequency * ratio, duration)
+        _, frequency, _, amount, velocity = hits.columns
+        frequency_modulation = frequency + modulator * amount
+        normalized_time = hits.linspace(0, 1)
         envelope = np.power(0.5, 25 * normalized_time)
-        actual_time = np.arange(int((self.sample_rate / 1000) * duration)) / self.sample_rate
-        woodblock = 1 * np.sin(2 * np.pi * frequency_modulation * actual_time) * envelope
-        return woodblock
+        actual_time = hits.seconds()
+        woodblock = 1 * np.sin(2 * np.pi * frequency_modulation * actual_time) * envelope * velocity
+        return hits.finish(woodblock)
 
 
 class MidTom:
@@ -203,35 +406,42 @@ class MidTom:
 
     Attributes:
         sample_rate (int): The sample rate of the sound.
+        rng (Generator): Source of the noise, the global numpy random state unless given.
 
     Methods:
         generate_noise(duration): Generate noise for the mid-tom.
         create_filter(): Create filters for processing mid-tom sounds.
         generate_sine_sweep(duration, start_frequency, end_frequency): Generate a sine sweep.
-        generate_mid_tom_sound(frequency, duration): Generate a mid-tom sound.
+        generate_mid_tom_sound(frequency, duration, velocity): Generate a mid-tom sound, or a batch of them.
     """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_noise(self, duration):
-        noise = np.random.random_sample(int((self.sample_rate / 1000) * duration)) * 2 - 1
-        return noise
+        hits = HitBatch(self.sample_rate, duration)
+        noise = hits.random(self.rng) * 2 - 1
+        return hits.finish(noise)
 
     def create_filter(self):
-        sos_high_pass = butter(10, 70, 'hp', fs=1000, analog=False, output='sos')
-        sos_low_pass = butter(2, 30, 'lp', fs=1000, analog=False, output='sos')
+        sos_high_pass = filter_registry.design(10, 70, 'hp', fs=1000)
+        sos_low_pass = filter_registry.design(2, 30, 'lp', fs=1000)
         return sos_high_pass, sos_low_pass
 
     def generate_sine_sweep(self, duration, start_frequency, end_frequency):
-        normalized_time = np.linspace(0, 1, int((self.sample_rate / 1000) * duration))
+        hits = HitBatch(self.sample_rate, duration, start_frequency, end_frequency)
+        _, start_frequency, end_frequency = hits.columns
+        normalized_time = hits.linspace(0, 1)
         sweep = (np.sqrt(start_frequency) + (np.sqrt(end_frequency) - np.sqrt(start_frequency)) * normalized_time)
         sweep = np.power(sweep, 2)
-        actual_time = np.arange(int((self.sample_rate / 1000) * duration)) / self.sample_rate
-        return np.sin(2 * np.pi * sweep * actual_time)
+        actual_time = hits.seconds()
+        return hits.finish(np.sin(2 * np.pi * sweep * actual_time))
 
-    def generate_mid_tom_sound(self, frequency, duration):
-        time = np.linspace(1, 0, int((self.sample_rate / 1000) * duration))
+    def generate_mid_tom_sound(self, frequency, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, frequency, velocity)
+        duration, frequency, _ = hits.values
+        time = hits.linspace(1, 0)
         time = np.power(time, 2.5)
         noise = self.generate_noise(duration)
         sos_high_pass, sos_low_pass = self.create_filter()
@@ -239,8 +449,8 @@ class MidTom:
         sine_sweep = sine_sweep * time * 2.5
         filtered_noise = sosfilt(sos_high_pass, noise)
         filtered_noise_2 = sosfilt(sos_low_pass, filtered_noise)
-        mid_tom = sine_sweep + (filtered_noise_2 * time) * 0.085
-        return mid_tom
+        mid_tom = (sine_sweep + (filtered_noise_2 * time) * 0.085) * hits.columns[2]
+        return hits.finish(mid_tom)
 
 
 class Clap:
@@ -249,35 +459,39 @@ class Clap:
 
      Attributes:
          sample_rate (int): The sample rate of the sound.
+         rng (Generator): Source of the noise, the global numpy random state unless given.
 
      Methods:
          generate_noise(duration): Generate noise for the clap.
          create_filter(): Create filters for processing clap sounds.
-         generate_clap_sound(duration): Generate a clap sound.
+         generate_clap_sound(duration, velocity): Generate a clap sound, or a batch of them.
      """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_noise(self, duration):
-        noise = np.random.random_sample(int((self.sample_rate / 1000) * duration)) * 2 - 1
-        return noise
+        hits = HitBatch(self.sample_rate, duration)
+        noise = hits.random(self.rng) * 2 - 1
+        return hits.finish(noise)
 
     def create_filter(self):
-        sos_high_pass = butter(10, 1000, 'hp', fs=self.sample_rate, analog=False, output='sos')
-        sos_low_pass = butter(4, 5000, 'lp', fs=self.sample_rate, analog=False, output='sos')
+        sos_high_pass = filter_registry.design(10, 1000, 'hp', fs=self.sample_rate)
+        sos_low_pass = filter_registry.design(4, 5000, 'lp', fs=self.sample_rate)
         return sos_high_pass, sos_low_pass
 
-    def generate_clap_sound(self, duration):
-        time = np.linspace(1, 0, int((self.sample_rate / 1000) * duration))
+    def generate_clap_sound(self, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, velocity)
+        duration, velocity = hits.values[0], hits.columns[1]
+        time = hits.linspace(1, 0)
         time = np.power(time, 1.5)
         noise = self.generate_noise(duration)
         sos_high_pass, sos_low_pass = self.create_filter()
         filtered_noise = sosfilt(sos_high_pass, noise)
         filtered_noise = sosfilt(sos_low_pass, filtered_noise)
-        clap_sound = filtered_noise * time * 2
-        clap_sound_int16 = (clap_sound * np.iinfo(np.int16).max).astype(np.int16)
-        return clap_sound_int16
+        clap_sound = filtered_noise * time * 2 * velocity
+        return hits.finish(clap_sound)
 
 
 class Tambourine:
@@ -286,42 +500,46 @@ class Tambourine:
 
      Attributes:
          sample_rate (int): The sample rate of the sound.
+         rng (Generator): Source of the noise, the global numpy random state unless given.
 
      Methods:
          generate_smooth_noise(duration): Generate smooth noise for the tambourine.
          generate_jingle(frequency, duration): Generate a jingle sound.
          create_filter(): Create filters for processing tambourine sounds.
-         generate_tambourine_sound(duration): Generate a tambourine sound.
+         generate_tambourine_sound(duration, velocity): Generate a tambourine sound, or a batch of them.
      """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_smooth_noise(self, duration):
-        num_samples = int((self.sample_rate / 1000) * duration)
-        noise = np.random.normal(0, 0.3, num_samples)
-        return noise
+        hits = HitBatch(self.sample_rate, duration)
+        noise = hits.normal(self.rng, 0, 0.3)
+        return hits.finish(noise)
 
     def generate_jingle(self, frequency, duration):
-        num_samples = int((self.sample_rate / 1000) * duration)
-        time = np.linspace(0, duration / 1000, num_samples)
+        hits = HitBatch(self.sample_rate, duration, frequency)
+        duration, frequency = hits.columns
+        time = hits.linspace(0, duration / 1000)
         envelope = np.exp(-10 * time)
         jingle_signal = np.sin(2 * np.pi * frequency * time) * envelope
-        return jingle_signal
+        return hits.finish(jingle_signal)
 
     def create_filter(self):
-        sos_band_pass = butter(4, [1000, 8000], 'band', fs=self.sample_rate, output='sos')
+        sos_band_pass = filter_registry.design(4, [1000, 8000], 'band', fs=self.sample_rate)
         return sos_band_pass
 
-    def generate_tambourine_sound(self, duration):
+    def generate_tambourine_sound(self, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, velocity)
+        duration, velocity = hits.values[0], hits.columns[1]
         noise = self.generate_smooth_noise(duration)
         jingle = self.generate_jingle(3000, duration)
         tambourine_sound = noise + jingle
         sos_band_pass = self.create_filter()
         filtered_tambourine_sound = sosfilt(sos_band_pass, tambourine_sound)
-        tambourine_sound = filtered_tambourine_sound * 1.5
-        tambourine_sound_int16 = (tambourine_sound * np.iinfo(np.int16).max).astype(np.int16)
-        return tambourine_sound_int16
+        tambourine_sound = filtered_tambourine_sound * 1.5 * velocity
+        return hits.finish(tambourine_sound)
 
 
 class Bongo:
@@ -330,36 +548,40 @@ class Bongo:
 
        Attributes:
            sample_rate (int): The sample rate of the sound.
+           rng (Generator): Accepted like for every instrument, the bongo uses no noise.
 
        Methods:
            generate_tone(frequency, duration): Generate a tone for the bongo.
            create_filter(): Create filters for processing bongo sounds.
-           generate_bongo_sound(duration): Generate a bongo sound.
+           generate_bongo_sound(duration, velocity): Generate a bongo sound, or a batch of them.
        """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
     def generate_tone(self, frequency, duration):
-        num_samples = int((self.sample_rate / 1000) * duration)
-        time = np.linspace(0, duration / 1000, num_samples)
+        hits = HitBatch(self.sample_rate, duration, frequency)
+        duration, frequency = hits.columns
+        time = hits.linspace(0, duration / 1000)
         envelope = np.exp(-10 * time)
         tone_signal = np.sin(2 * np.pi * frequency * time) * envelope
-        return tone_signal
+        return hits.finish(tone_signal)
 
     def create_filter(self):
-        sos_band_pass = butter(4, [100, 2000], 'band', fs=self.sample_rate, output='sos')
+        sos_band_pass = filter_registry.design(4, [100, 2000], 'band', fs=self.sample_rate)
         return sos_band_pass
 
-    def generate_bongo_sound(self, duration):
+    def generate_bongo_sound(self, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, velocity)
+        duration, velocity = hits.values[0], hits.columns[1]
         low_tone = self.generate_tone(200, duration)
         high_tone = self.generate_tone(400, duration)
         bongo_sound = low_tone + high_tone
         sos_band_pass = self.create_filter()
-        filtered_bongo_sound = sosfilt(sos_band_pass, bongo_sound)
-        bongo_sound = filtered_bongo_sound / np.max(np.abs(filtered_bongo_sound))
-        bongo_sound_int16 = (bongo_sound * np.iinfo(np.int16).max).astype(np.int16)
-        return bongo_sound_int16
+        filtered_bongo_sound = np.where(hits.mask, sosfilt(sos_band_pass, bongo_sound), 0)
+        bongo_sound = filtered_bongo_sound / np.max(np.abs(filtered_bongo_sound), axis=-1, keepdims=True)
+        return hits.finish(bongo_sound * velocity)
 
 
 class Tabla:
@@ -368,29 +590,130 @@ class Tabla:
 
        Attributes:
            sample_rate (int): The sample rate of the sound.
+           rng (Generator): Source of the noise, the global numpy random state unless given.
 
        Methods:
-           generate_drum_sound(frequency, duration): Generate a tabla drum sound.
+           generate_drum_sound(frequency, duration, velocity): Generate a tabla drum sound, or a batch of them.
        """
 
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, rng=None):
         self.sample_rate = sample_rate
+        self.rng = rng if rng is not None else np.random
 
-    def generate_drum_sound(self, frequency, duration):
-        num_samples = int((self.sample_rate / 1000) * duration)
-        time = np.linspace(0, duration / 1000, num_samples)
+    def generate_drum_sound(self, frequency, duration, velocity=1.0):
+        hits = HitBatch(self.sample_rate, duration, frequency, velocity)
+        duration, frequency, velocity = hits.columns
+        time = hits.linspace(0, duration / 1000)
         bass_wave = np.sin(2 * np.pi * frequency * time)
         treble_wave = np.sin(2 * np.pi * (frequency * 1.6) * time)
 
-        noise = np.random.normal(0, 0.05, len(time))
+        noise = hits.normal(self.rng, 0, 0.05)
         tabla_sound = (bass_wave + treble_wave) * (1 - 0.4 * time) + noise * (1 - 0.5 * time)
 
-        sos = butter(4, 1000, 'lp', fs=self.sample_rate, output='sos')
-        tabla_sound = sosfilt(sos, tabla_sound)
+        sos = filter_registry.design(4, 1000, 'lp', fs=self.sample_rate)
+        tabla_sound = np.where(hits.mask, sosfilt(sos, tabla_sound), 0)
+
+        tabla_sound /= np.max(np.abs(tabla_sound), axis=-1, keepdims=True)
+        return hits.finish(tabla_sound * velocity)
 
-        tabla_sound /= np.max(np.abs(tabla_sound))
-        tabla_sound_int16 = (tabla_sound * np.iinfo(np.int16).max).astype(np.int16)
-        return tabla_sound_int16
+
+class VoiceBank:
+    """
+       A memoized bank of rendered instrument hits.
+
+       Voices are keyed by instrument, synthesis parameters, duration, sample rate,
+       an optional noise seed and sample format. The least recently used voices are
+       evicted once the bank grows past its memory budget. Returned arrays are
+       read-only because they are shared between callers. Filters run in float64,
+       and each voice is stored in the requested floating point dtype. A seeded
+       voice draws its noise from its own numpy Generator, spawned from the seed
+       for that instrument, so it never depends on other renders or threads.
+
+       Attributes:
+           max_bytes (int): Memory budget for the cached voices.
+           sample_rate (int): Sample rate used to render the voices.
+           dtype (dtype): Default sample format of the voices, float32 unless given.
+           hits (int): Number of lookups served from the bank.
+           misses (int): Number of lookups that had to synthesize a voice.
+
+       Methods:
+           get(instrument, params, duration, seed, dtype): Return a rendered hit.
+           generator(instrument, seed): Return the noise generator of an instrument for a seed.
+           clear(): Drop every cached voice.
+       """
+
+    renderers = {
+        'kick': (Kick, 'generate_kick_sound'),
+        'snare': (Snare, 'generate_snare_sound'),
+        'hi_hat': (HiHat, 'generate_hi_hat'),
+        'open_hat': (OpenHat, 'generate_open_hat'),
+        'wood_block': (WoodBlock, 'generate_woodblock'),
+        'mid_tom': (MidTom, 'generate_mid_tom_sound'),
+        'clap': (Clap, 'generate_clap_sound'),
+        'tambourine': (Tambourine, 'generate_tambourine_sound'),
+        'bongo': (Bongo, 'generate_bongo_sound'),
+        'tabla': (Tabla, 'generate_drum_sound'),
+    }
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, sample_rate=44100, dtype=np.float32):
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self.voices = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, instrument, params=(), duration=150, seed=None, dtype=None):
+        dtype = np.dtype(dtype) if dtype is not None else self.dtype
+        key = (instrument, tuple(params), duration, self.sample_rate, seed, dtype)
+        with self.lock:
+            voice = self.voices.get(key)
+            if voice is not None:
+                self.voices.move_to_end(key)
+                self.hits += 1
+                return voice
+            self.misses += 1
+
+        voice = self.render(instrument, params, duration, seed, dtype)
+        voice.setflags(write=False)
+
+        with self.lock:
+            if key not in self.voices and voice.nbytes <= self.max_bytes:
+                self.voices[key] = voice
+                self.nbytes += voice.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self.voices.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return voice
+
+    def render(self, instrument, params, duration, seed, dtype=None):
+        dtype = dtype if dtype is not None else self.dtype
+        instrument_class, method = self.renderers[instrument]
+        rng = self.generator(instrument, seed) if seed is not None else None
+        generate = getattr(instrument_class(self.sample_rate, rng), method)
+        with span('synthesis') as stage:
+            return stage.add(generate(*params, duration).astype(dtype))
+
+    @classmethod
+    def generator(cls, instrument, seed):
+        stream = list(cls.renderers).index(instrument)
+        return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream,)))
+
+    def clear(self):
+        with self.lock:
+            self.voices.clear()
+            self.nbytes = 0
+
+
+default_voice_bank = VoiceBank()
+
+
+def to_int16(signal):
+    """Scale a float signal in [-1, 1] to int16 PCM, clipping anything louder."""
+    scaled = np.multiply(signal, np.iinfo(np.int16).max, dtype=np.float64)
+    return np.clip(scaled, np.iinfo(np.int16).min, np.iinfo(np.int16).max).astype(np.int16)
 
 
 class Panning:
@@ -398,118 +721,543 @@ class Panning:
        A class for panning audio signals.
 
        Methods:
+           gains(angle): Return the left and right gains for a panning angle.
            pann(x, angle): Apply panning to an audio signal.
-           generate_random_sequence(length): Generate a random panning sequence.
+           generate_random_sequence(length, rng): Generate a random panning sequence.
        """
 
-    def pann(self, x, angle):
+    def gains(self, angle):
         cos_a = np.cos(angle)
         sin_a = np.sin(angle)
         stereo_factor = np.sqrt(2) / 2.0
+        return np.array([stereo_factor * (cos_a - sin_a), stereo_factor * (cos_a + sin_a)])
 
-        left = stereo_factor * (cos_a - sin_a) * x
-        right = stereo_factor * (cos_a + sin_a) * x
+    def pann(self, x, angle):
+        x = np.asarray(x)
+        left_gain, right_gain = self.gains(angle).astype(np.result_type(x, np.float32))
 
-        return np.column_stack((left, right))
+        with span('panning') as stage:
+            stereo = np.empty((len(x), 2), dtype=np.result_type(x, np.float32))
+            np.multiply(x, left_gain, out=stereo[:, 0])
+            np.multiply(x, right_gain, out=stereo[:, 1])
+            return stage.add(stereo)
 
-    def generate_random_sequence(self, length):
-        sequence = ''.join(random.choice(['^', '_']) for _ in range(length))
+    def generate_random_sequence(self, length, rng=None):
+        sequence = Pattern.random(1, length, rng=rng).to_strings()[0]
         return sequence
 
 
+class MixBus:
+    """
+       A mixer that pans and sums mono stems into stereo with a single matrix multiply.
+
+       Every channel strip has a gain, a pan angle, and mute and solo switches.
+       The left and right levels of all strips form a (strips, 2) matrix that is
+       recomputed whenever a strip changes. Stems stacked into one
+       (strips, samples) array are then mixed by multiplying them with the
+       matrix straight into the stereo output, so no stem is ever copied,
+       panned or scaled on its own. A muted strip, or any strip while others
+       are soloed, gets zero levels. Listeners are called after every change,
+       which is how a playing StreamEngine picks up mute and solo.
+
+       Attributes:
+           dtype (dtype): Sample format of the matrix and the mix.
+           levels (ndarray): The (strips, 2) left and right gains set on the strips.
+           muted (ndarray): Which strips are muted.
+           soloed (ndarray): Which strips are soloed.
+           matrix (ndarray): The (strips, 2) levels of the audible strips, used for mixing.
+           listeners (list): Callables called with the bus whenever its matrix changes.
+
+       Methods:
+           strip_levels(gain, pan): Return the left and right gains of a strip.
+           add_strip(gain, pan): Add a strip and return its index.
+           set_strip(strip, gain, pan): Change the gain and pan of a strip.
+           mute(strip, muted): Mute or unmute a strip.
+           solo(strip, soloed): Solo or unsolo a strip.
+           mix(stems, out, strips): Mix (strips, samples) stems, or those of some strips, into a (samples, 2) buffer.
+       """
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.listeners = []
+        self.levels = np.zeros((0, 2))
+        self.muted = np.zeros(0, dtype=bool)
+        self.soloed = np.zeros(0, dtype=bool)
+        self.update()
+
+    @staticmethod
+    def strip_levels(gain, pan=None):
+        """Without a pan angle the gain is used as is, a single gain for both sides or a (left, right) pair."""
+        if pan is None:
+            return np.broadcast_to(np.asarray(gain, dtype=np.float64), (2,))
+        return Panning().gains(pan) * gain
+
+    def add_strip(self, gain=1.0, pan=None):
+        self.levels = np.vstack((self.levels, self.strip_levels(gain, pan)))
+        self.muted = np.append(self.muted, False)
+        self.soloed = np.append(self.soloed, False)
+        self.update()
+        return len(self.levels) - 1
+
+    def set_strip(self, strip, gain=1.0, pan=None):
+        self.levels[strip] = self.strip_levels(gain, pan)
+        self.update()
+
+    def mute(self, strip, muted=True):
+        self.muted[strip] = muted
+        self.update()
+
+    def solo(self, strip, soloed=True):
+        self.soloed[strip] = soloed
+        self.update()
+
+    def update(self):
+        audible = ~self.muted & (self.soloed | ~self.soloed.any())
+        self.matrix = (self.levels * audible[:, np.newaxis]).astype(self.dtype)
+        for listener in self.listeners:
+            listener(self)
+
+    def mix(self, stems, out=None, strips=None):
+        """Write the mix into `out`, or into a new buffer, and return it. `strips` picks the strips of the stems."""
+        stems = np.asarray(stems)
+        matrix = self.matrix if strips is None else self.matrix[strips]
+        if len(stems) != len(matrix):
+            raise ValueError(f"expected {len(matrix)} stems, got {len(stems)}")
+        if out is None:
+            out = np.empty((stems.shape[1], 2), dtype=np.result_type(stems, self.dtype))
+        with span('panning') as stage:
+            np.matmul(stems.T, matrix.astype(out.dtype, copy=False), out=out)
+            return stage.add(out)
+
+
+class Pattern:
+    """
+       A drum pattern stored as a boolean matrix of instruments by steps.
+
+       Patterns can be built from and turned back into the '^' (hit) and '_'
+       (rest) strings used elsewhere, and packed to one bit per step for storage.
+       Random patterns are drawn in a single vectorized call for a whole batch.
+
+       Attributes:
+           hits (ndarray): Boolean array of shape (instruments, steps).
+
+       Methods:
+           random(instruments, steps, density, rng): Generate a random pattern.
+           random_batch(count, instruments, steps, density, rng): Generate a batch of random hit matrices.
+           from_strings(sequences): Build a pattern from '^'/'_' strings.
+           to_strings(): Return the pattern as '^'/'_' strings.
+           pack(): Pack the pattern to bits.
+           unpack(packed, steps): Build a pattern from packed bits.
+           toggle(instrument, step): Flip a single cell.
+           clear(): Remove every hit.
+       """
+
+    def __init__(self, hits):
+        self.hits = np.asarray(hits, dtype=bool)
+
+    @classmethod
+    def empty(cls, instruments, steps):
+        return cls(np.zeros((instruments, steps), dtype=bool))
+
+    @classmethod
+    def random(cls, instruments, steps, density=0.5, rng=None):
+        return cls(cls.random_batch(1, instruments, steps, density, rng)[0])
+
+    @staticmethod
+    def random_batch(count, instruments, steps, density=0.5, rng=None):
+        """
+        The density is the probability of a hit. It may be a scalar or any array
+        that broadcasts against (count, instruments, steps), for example one
+        density per instrument of shape (instruments, 1).
+        """
+        rng = rng if rng is not None else np.random
+        return rng.random((count, instruments, steps)) < density
+
+    @classmethod
+    def from_strings(cls, sequences):
+        codes = np.array([np.frombuffer(sequence.encode(), dtype=np.uint8) for sequence in sequences])
+        return cls(codes == ord('^'))
+
+    def to_strings(self):
+        codes = np.where(self.hits, ord('^'), ord('_')).astype(np.uint8)
+        return [row.tobytes().decode() for row in codes]
+
+    def pack(self):
+        return np.packbits(self.hits, axis=-1)
+
+    @classmethod
+    def unpack(cls, packed, steps):
+        return cls(np.unpackbits(packed, axis=-1, count=steps).astype(bool))
+
+    @property
+    def instruments(self):
+        return self.hits.shape[0]
+
+    @property
+    def steps(self):
+        return self.hits.shape[1]
+
+    def toggle(self, instrument, step):
+        self.hits[instrument, step] = not self.hits[instrument, step]
+
+    def clear(self):
+        self.hits[:] = False
+
+
+class Sequencer:
+    """
+       A class for placing instrument hits on a preallocated stereo timeline.
+
+       Every track is rendered as a mono stem of one pass of the pattern, with
+       its hits added in place, so the cost of a render grows with the number of
+       hits rather than the number of steps. The stems are rows of a single
+       (tracks, samples) array, which the mix bus pans and sums with one matrix
+       multiply into the first pass of the output buffer. The repetitions are
+       filled by broadcasting it into the rest of the buffer. Stems and
+       repetitions can be spread over a thread pool, and the output is identical
+       for any number of workers. A hit that runs past the end of the pattern is
+       cut off there. The step length may be fractional, in which case every hit
+       starts at the nearest sample. Voices are mono (N,) arrays, or already
+       stereo (N, 2) arrays, such as a whole pre-rendered beat, which are added
+       to the mix with the levels of their strip.
+
+       Attributes:
+           step_length (float): Number of samples between two steps.
+           steps (int): Number of steps in one pass of the pattern.
+           repetition (int): Number of times the pattern is repeated.
+           dtype (dtype): Sample format of the mix, float32 unless given.
+           tracks (list): The (voice, hits) of every added instrument.
+           bus (MixBus): The mix bus, with one strip per track.
+
+       Methods:
+           from_pattern(pattern, voices, gains, step_length, repetition, dtype): Build a sequencer from a Pattern.
+           add_track(voice, hits, gain, pan): Add an instrument playing at the given steps.
+           render_stem(track, stem): Add the hits of a mono track to its stem.
+           render_cycle(workers, out): Mix one pass of every track.
+           render(workers): Mix every track into a single stereo buffer.
+           iter_chunks(chunk_size, workers): Yield the mix in fixed-size chunks.
+       """
+
+    def __init__(self, step_length, steps, repetition=1, dtype=np.float32):
+        self.step_length = step_length
+        self.steps = steps
+        self.repetition = repetition
+        self.dtype = np.dtype(dtype)
+        self.tracks = []
+        self.bus = MixBus(dtype)
+
+    @classmethod
+    def from_pattern(cls, pattern, voices, gains, step_length, repetition=1, dtype=np.float32):
+        """Only the voices of instruments that have hits are looked up, so `voices` may load lazily."""
+        sequencer = cls(step_length, pattern.steps, repetition, dtype)
+        for instrument in np.flatnonzero(pattern.hits.any(axis=1)):
+            sequencer.add_track(voices[instrument], pattern.hits[instrument], gains[instrument])
+        return sequencer
+
+    def add_track(self, voice, hits, gain=1.0, pan=None):
+        """The gain and pan set the strip of the track on the mix bus, see MixBus.strip_levels."""
+        hits = np.asarray(hits)
+        if hits.dtype == bool:
+            hits = np.flatnonzero(hits)
+        self.tracks.append((voice, hits))
+        return self.bus.add_strip(gain, pan)
+
+    def starts(self, hits):
+        return np.round(hits * self.step_length).astype(int)
+
+    def render_stem(self, track, stem):
+        voice, hits = track
+        with span('mixing'):
+            for start in self.starts(hits):
+                stop = min(start + len(voice), len(stem))
+                stem[start:stop] += voice[:stop - start]
+
+    @property
+    def cycle(self):
+        return round(self.step_length * self.steps)
+
+    def render_cycle(self, workers=1, out=None):
+        """Mix one pass into `out`, or into a new buffer, rendering the stems on `workers` threads."""
+        cycle = self.cycle
+        out = out if out is not None else np.empty((cycle, 2), dtype=self.dtype)
+        mono = [track[0].ndim == 1 for track in self.tracks]
+        # Rows of stereo tracks stay silent in the stem array, they are added to the mix afterwards.
+        with span('mixing') as stage:
+            stems = np.zeros((len(self.tracks), cycle), dtype=self.dtype)
+            stage.add(stems, stems.size)
+        mono_tracks = [(track, stem) for track, stem, is_mono in zip(self.tracks, stems, mono) if is_mono]
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(carry(lambda item: self.render_stem(*item)), mono_tracks))
+        else:
+            for track, stem in mono_tracks:
+                self.render_stem(track, stem)
+        self.bus.mix(stems, out)
+
+        for (voice, hits), levels, is_mono in zip(self.tracks, self.bus.matrix, mono):
+            if not is_mono:
+                with span('mixing'):
+                    for start in self.starts(hits):
+                        stop = min(start + len(voice), cycle)
+                        out[start:stop] += voice[:stop - start] * levels
+        return out
+
+    def render(self, workers=1):
+        """With more than one worker, stems and repetitions are rendered on a thread pool of that size."""
+        cycle = self.cycle
+        out = np.empty((cycle * self.repetition, 2), dtype=self.dtype)
+        self.render_cycle(workers, out[:cycle])
+
+        passes = out.reshape(self.repetition, cycle, 2)
+        bounds = np.linspace(1, self.repetition, min(workers, max(self.repetition - 1, 1)) + 1).astype(int)
+
+        def fill(start, stop):
+            passes[start:stop] = out[:cycle]
+
+        with span('tiling') as stage:
+            if workers > 1:
+                with ThreadPoolExecutor(workers) as executor:
+                    list(executor.map(fill, bounds[:-1], bounds[1:]))
+            else:
+                fill(1, self.repetition)
+            stage.add(out[cycle:])
+        return out
+
+    def iter_chunks(self, chunk_size=8192, workers=1):
+        """
+        Return an iterator over the render in (chunk_size, 2) chunks, the last one shorter.
+
+        Only one pass of the pattern is held in memory, so the working memory
+        does not depend on the number of repetitions. The chunks are exactly
+        the consecutive slices of render(). The pass is mixed right away, in the
+        caller, so pulling a chunk only copies samples.
+        """
+        cycle_buffer = self.render_cycle(workers)
+        cycle = len(cycle_buffer)
+        total = cycle * self.repetition
+
+        def chunks():
+            for start in range(0, total, chunk_size):
+                chunk = np.empty((min(chunk_size, total - start), 2), dtype=self.dtype)
+                filled = 0
+                while filled < len(chunk):
+                    offset = (start + filled) % cycle
+                    count = min(len(chunk) - filled, cycle - offset)
+                    chunk[filled:filled + count] = cycle_buffer[offset:offset + count]
+                    filled += count
+                yield chunk
+        return chunks()
+
+
 class GenerateBeat:
     """
        A class for generating beats.
 
+       With a seed, the beat is a pure function of the seed and the other
+       arguments. The pattern and the track order are drawn from their own numpy
+       Generators, and the voices are seeded with the seed too unless a
+       voice_seed is given. Without a seed, the global `random` and numpy states
+       are used as before.
+
+       With more than one worker, the seeded voices are synthesized and the
+       stems of both beats are sequenced and panned on a thread pool. The output
+       is identical to a single-threaded render.
+
        Attributes:
            repetition (int): Number of repetitions for each beat.
            duration (int): Duration of each beat.
+           voice_bank (VoiceBank): Bank the instrument hits are taken from.
+           voice_seed (int): Noise seed of the instrument hits, or None for any cached hit.
+           dtype (dtype): Sample format of the voices and beats, float32 unless given.
+           seed (int): Seed of the pattern, order and voices, or None to use the global random state.
+           workers (int): Number of threads rendering the voices and stems.
 
        Methods:
            pause(note): Generate a pause in the beat.
+           voices(): Return the voices of the kit.
+           generate_sequencers(): Generate the sequencers of both beats without rendering them.
            generate_sound(): Generate a beat sequence.
-           panning_mixture(instrument_seq): Mix and pan instruments.
+           generate_chunks(beat, chunk_size, effects): Generate one beat as a stream of chunks.
+           mix_bus(count): Return a mix bus with the gain and pan of the first `count` tracks.
+           sequence_tracks(tracks, step_length, steps): Build a sequencer from (voice, hits) tracks.
+           mix_tracks(tracks, step_length, steps): Sequence, pan and mix (voice, hits) tracks.
+           panning_mixture(instrument_seq): Mix and pan already sequenced instruments.
        """
 
-    def __init__(self, repetition, duration=150):
+    kit = [('kick', (30,)), ('snare', (250,)), ('hi_hat', ()), ('open_hat', ()), ('wood_block', (880, 2.25, 80)),
+           ('clap', ()), ('tambourine', ()), ('bongo', ()), ('tabla', (150,))]
+
+    def __init__(self, repetition, duration=150, voice_bank=None, voice_seed=None, dtype=np.float32, seed=None,
+                 workers=1):
         self.duration = duration
         self.repetition = repetition
+        self.voice_bank = voice_bank if voice_bank is not None else default_voice_bank
+        self.voice_seed = voice_seed if voice_seed is not None or seed is None else seed
+        self.dtype = np.dtype(dtype)
+        self.seed = seed
+        self.workers = workers
         self.panning_values = [0.03, 0, -15, 15, -35, 35]
         self.volume_mix_values = [1, 1, 0.4, 0.35, 0.6, 0.6]
-        self.pann = Panning()
 
     def pause(self, note):
         paused = np.zeros_like(note)
         return paused
 
-    def generate_sound(self):
+    def generate_sequencers(self):
 
-        length = random.randint(5, 15)
-        kick_pat = self.pann.generate_random_sequence(length)
-        snare_pat = self.pann.generate_random_sequence(length)
-        hihat_pat = self.pann.generate_random_sequence(length)
-        open_hat_pat = self.pann.generate_random_sequence(length)
-        wood_block_pat = self.pann.generate_random_sequence(length)
-        mid_tom_pat = self.pann.generate_random_sequence(length)
+        with span('pattern'):
+            if self.seed is None:
+                length = random.randint(5, 15)
+                pattern = Pattern.random(10, length)
+                shuffle = random.shuffle
+            else:
+                pattern_rng, order_rng = (np.random.default_rng(seed)
+                                          for seed in np.random.SeedSequence(self.seed).spawn(2))
+                length = int(pattern_rng.integers(5, 16))
+                pattern = Pattern.random(10, length, rng=pattern_rng)
+                shuffle = order_rng.shuffle
+        kick_pat, snare_pat, hihat_pat, open_hat_pat, wood_block_pat, mid_tom_pat = pattern.hits[:6]
 
         # Next set of instruments
-        clap_pat = self.pann.generate_random_sequence(length)
-        tambourine_pat = self.pann.generate_random_sequence(length)
-        bongo_pat = self.pann.generate_random_sequence(length)
-        tabla_pat = self.pann.generate_random_sequence(length)
-
-        kick_sound = Kick().generate_kick_sound(30, self.duration)
-        snare_sound = Snare().generate_snare_sound(250, self.duration)
-        hihat_sound = HiHat().generate_hi_hat(self.duration)
-        open_hat_sound = OpenHat().generate_open_hat(self.duration)
-        wood_block_sound = WoodBlock().generate_woodblock(880, 2.25, 80, self.duration)
-        mid_tom_sound = MidTom().generate_mid_tom_sound(175, self.duration)
-
-        # Next set of sounds
-        clap_sound = Clap().generate_clap_sound(self.duration)
-        tambourine_sound = Tambourine().generate_tambourine_sound(self.duration)
-        bongo_sound = Bongo().generate_bongo_sound(self.duration)
-        tabla_sound = Tabla().generate_drum_sound(150, self.duration)
-
-        kick_seq = np.concatenate([kick_sound if char == '^' else self.pause(kick_sound) for char in kick_pat])
-        snare_seq = np.concatenate([snare_sound if char == '^' else self.pause(snare_sound) for char in snare_pat])
-        hihat_seq = np.concatenate([hihat_sound if char == '^' else self.pause(hihat_sound) for char in hihat_pat])
-        open_hat_seq = np.concatenate(
-            [open_hat_sound if char == '^' else self.pause(open_hat_sound) for char in open_hat_pat])
-        wood_block_seq = np.concatenate(
-            [wood_block_sound if char == '^' else self.pause(wood_block_sound) for char in wood_block_pat])
-        mid_tom_seq = np.concatenate(
-            [wood_block_sound if char == '^' else self.pause(mid_tom_sound) for char in mid_tom_pat])
+        clap_pat, tambourine_pat, bongo_pat, tabla_pat = pattern.hits[6:]
+
+        (kick_sound, snare_sound, hihat_sound, open_hat_sound, wood_block_sound,
+         clap_sound, tambourine_sound, bongo_sound, tabla_sound) = self.voices()
+
+        step_length = len(kick_sound)
+        tracks = [(kick_sound, kick_pat), (snare_sound, snare_pat), (hihat_sound, hihat_pat),
+                  (open_hat_sound, open_hat_pat), (wood_block_sound, wood_block_pat),
+                  (wood_block_sound, mid_tom_pat)]
+        shuffle(tracks)
+        sequencer = self.sequence_tracks(tracks, step_length, length)
 
         # Next set
-        clap_seq = np.concatenate([clap_sound if char == '^' else self.pause(clap_sound) for char in clap_pat])
-        tambourine_seq = np.concatenate(
-            [tambourine_sound if char == '^' else self.pause(tambourine_sound) for char in tambourine_pat])
-        bongo_seq = np.concatenate([bongo_sound if char == '^' else self.pause(bongo_sound) for char in bongo_pat])
-        tabla_seq = np.concatenate([tabla_sound if char == '^' else self.pause(tabla_sound) for char in tabla_pat])
+        tracks_2 = [(clap_sound, clap_pat), (tambourine_sound, tambourine_pat), (bongo_sound, bongo_pat),
+                    (tabla_sound, tabla_pat), (bongo_sound, bongo_pat), (tambourine_sound, tambourine_pat)]
+        shuffle(tracks_2)
+        sequencer_2 = self.sequence_tracks(tracks_2, step_length, length)
+        return sequencer, sequencer_2
+
+    def voices(self):
+        def get(voice):
+            instrument, params = voice
+            return self.voice_bank.get(instrument, params, self.duration, self.voice_seed, self.dtype)
+
+        # Unseeded voices draw from the global random state, so they are synthesized one after another.
+        if self.workers == 1 or self.voice_seed is None:
+            return [get(voice) for voice in self.kit]
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(carry(get), self.kit))
+
+    def generate_sound(self):
+        sequencer, sequencer_2 = self.generate_sequencers()
+        return sequencer.render(self.workers), sequencer_2.render(self.workers)
 
-        instrument_seq = [kick_seq, snare_seq, hihat_seq, open_hat_seq, wood_block_seq, mid_tom_seq]
-        random.shuffle(instrument_seq)
-        beats = self.panning_mixture(instrument_seq)
+    def generate_chunks(self, beat=1, chunk_size=8192, effects=()):
+        """
+        Return an iterator over beat 1 or 2 in fixed-size stereo chunks, passed through `effects` in order.
 
-        instrument_seq_2 = [clap_seq, tambourine_seq, bongo_seq, tabla_seq, bongo_seq, tambourine_seq]
-        random.shuffle(instrument_seq_2)
-        beats_2 = self.panning_mixture(instrument_seq_2)
-        return beats, beats_2
+        Effects are objects with a process(block) method, like FeedbackDelay, and
+        keep their state from chunk to chunk. The working memory is one pass of
+        the pattern plus one chunk, however many repetitions are rendered. The
+        pattern, the synthesis and the mix of one pass run right away, in the
+        caller, so a stream callback pulling the chunks never has to wait for them.
+        """
+        sequencer = self.generate_sequencers()[beat - 1]
+        for effect in effects:
+            effect.reset()
+        cycle_chunks = sequencer.iter_chunks(chunk_size, self.workers)
+
+        def chunks():
+            for chunk in cycle_chunks:
+                for effect in effects:
+                    chunk = effect.process(chunk)
+                yield chunk
+        return chunks()
+
+    def mix_bus(self, count):
+        bus = MixBus(self.dtype)
+        for _, pan_val, vol_mix in zip(range(count), self.panning_values, self.volume_mix_values):
+            bus.add_strip(vol_mix, pan_val)
+        return bus
+
+    def sequence_tracks(self, tracks, step_length, steps):
+        sequencer = Sequencer(step_length, steps, self.repetition, self.dtype)
+        for (sound, hits), pan_val, vol_mix in zip(tracks, self.panning_values, self.volume_mix_values):
+            sequencer.add_track(sound, hits, vol_mix, pan_val)
+        return sequencer
+
+    def mix_tracks(self, tracks, step_length, steps):
+        return self.sequence_tracks(tracks, step_length, steps).render()
 
     def panning_mixture(self, instrument_seq):
-        panned_instruments = []
-        for inst, pan_val in zip(instrument_seq, self.panning_values):
-            panned_instruments.append(self.pann.pann(inst, pan_val))
+        bus = self.mix_bus(len(instrument_seq))
+        with span('mixing') as stage:
+            stems = stage.add(np.asarray(instrument_seq[:len(bus.matrix)], dtype=self.dtype))
+        beats = bus.mix(stems)
+        with span('tiling') as stage:
+            return stage.add(np.tile(beats, (self.repetition, 1)))
+
+
+class BeatMemo:
+    """
+       A memo of seeded beat renders.
+
+       A seeded render is fully determined by its seed and parameters, so both
+       beats are kept under (seed, repetition, duration, voice seed, dtype) and a
+       repeated request returns the same arrays without rendering. The least
+       recently used renders are evicted once the memo grows past its memory
+       budget. Returned arrays are read-only because they are shared.
 
-        vol_pan_inst = []
-        for inst, vol_mix in zip(panned_instruments, self.volume_mix_values):
-            tiled_sequence = np.tile(inst * vol_mix, (self.repetition, 1))
-            vol_pan_inst.append(tiled_sequence)
+       Attributes:
+           max_bytes (int): Memory budget for the memoized beats.
+           voice_bank (VoiceBank): Bank the instrument hits are taken from.
+           hits (int): Number of requests served from the memo.
+           misses (int): Number of requests that had to render.
 
-        beats = sum(vol_pan_inst)
+       Methods:
+           get(seed, repetition, duration, voice_seed, dtype): Return both beats of a seeded render.
+           clear(): Drop every memoized beat.
+       """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, voice_bank=None):
+        self.max_bytes = max_bytes
+        self.voice_bank = voice_bank if voice_bank is not None else default_voice_bank
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self.beats = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, seed, repetition=2, duration=150, voice_seed=None, dtype=np.float32):
+        key = (seed, repetition, duration, voice_seed, np.dtype(dtype))
+        with self.lock:
+            beats = self.beats.get(key)
+            if beats is not None:
+                self.beats.move_to_end(key)
+                self.hits += 1
+                return beats
+            self.misses += 1
+
+        beats = GenerateBeat(repetition, duration, self.voice_bank, voice_seed, dtype, seed).generate_sound()
+        for beat in beats:
+            beat.setflags(write=False)
+        nbytes = sum(beat.nbytes for beat in beats)
+
+        with self.lock:
+            if key not in self.beats and nbytes <= self.max_bytes:
+                self.beats[key] = beats
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self.beats.popitem(last=False)
+                    self.nbytes -= sum(beat.nbytes for beat in evicted)
         return beats
 
+    def clear(self):
+        with self.lock:
+            self.beats.clear()
+            self.nbytes = 0
+
 
 class Reverb(object):
     """
@@ -552,68 +1300,380 @@ class Reverb(object):
         return self.empty
 
 
+class FeedbackDelay:
+    """
+     A block-based feedback delay used for the reverb effect.
+
+     Produces the same output as feeding the signal sample by sample through a
+     Reverb ring buffer, but works on whole blocks: the signal is folded into
+     rows of `delay` samples so the feedback becomes a first-order recursion
+     down the rows, which scipy evaluates in C. Mono (N,) and multichannel
+     (N, channels) blocks are supported and channels are processed independently.
+     Floating point blocks are processed in their own precision, anything else
+     in float32 or wider.
+
+     Attributes:
+         delay (int): Delay length in samples.
+         wet (float): Amount of the delayed signal in the output.
+         reverb (float): Amount of the delayed signal fed back into the delay line.
+         tail (ndarray): The last `delay` samples written to the delay line.
+
+     Methods:
+         process(block): Apply the delay to the next block of a signal.
+         reset(): Clear the delay line.
+     """
+
+    def __init__(self, delay, wet, reverb):
+        if delay < 1:
+            raise ValueError("delay must be at least one sample")
+        self.delay = int(delay)
+        self.wet = wet
+        self.reverb = reverb
+        self.tail = None
+
+    def reset(self):
+        self.tail = None
+
+    def process(self, block):
+        block = np.asarray(block)
+        dtype = np.result_type(block, np.float32)
+        block = block.astype(dtype, copy=False)
+        length = block.shape[0]
+        channels = block.shape[1:]
+        if self.tail is None or self.tail.shape[1:] != channels or self.tail.dtype != dtype:
+            self.tail = np.zeros((self.delay,) + channels, dtype=dtype)
+
+        rows = -(-length // self.delay)
+        padded = np.zeros((rows * self.delay,) + channels, dtype=dtype)
+        padded[:length] = block
+        padded = padded.reshape((rows, self.delay) + channels)
+
+        zi = dtype.type(self.reverb) * self.tail[np.newaxis]
+        b = np.array([1 - self.reverb], dtype=dtype)
+        a = np.array([1, -self.reverb], dtype=dtype)
+        written, _ = lfilter(b, a, padded, axis=0, zi=zi)
+        written = written.reshape((rows * self.delay,) + channels)
+
+        delay_line = np.concatenate((self.tail, written[:length]))
+        delayed = delay_line[:length]
+        self.tail = delay_line[length:].copy()
+        return dtype.type(1 - self.wet) * block + dtype.type(self.wet) * delayed
+
+
+class ConvolutionReverb:
+    """
+     A convolution reverb using uniformly partitioned FFT overlap-add.
+
+     The impulse response is cut into partitions of `partition` samples, each
+     transformed once. Every block of input is transformed once as well, kept
+     in a delay line of spectra and multiplied with the partitions, so a tail of
+     any length costs a few spectrum products per block instead of a direct
+     convolution. Blocks of any size are accepted: a block that only partly
+     fills the current partition is convolved right away, so the output is never
+     delayed, and the work of the earlier partitions is reused. Mono (N,) and
+     multichannel (N, channels) blocks are supported. A mono impulse response is
+     applied to every channel, a stereo one channel by channel.
+
+     Attributes:
+         impulse_response (ndarray): The impulse response, (taps,) or (taps, channels).
+         wet (float): Amount of the reverberated signal in the output.
+         partition (int): Partition length in samples.
+         spectra (ndarray): Spectra of the impulse response partitions.
+
+     Methods:
+         synthetic(decay, sample_rate, channels, seed, ...): Create a reverb with a generated impulse response.
+         from_wav(path, sample_rate, ...): Create a reverb with an impulse response read from a WAV file.
+         process(block): Apply the reverb to the next block of a signal.
+         convolve(block, channels, dtype): Return the reverberated signal of the next block, without the dry signal.
+         reset(): Silence the reverb tail.
+     """
+
+    def __init__(self, impulse_response, wet=0.3, partition=1024, normalize=True):
+        impulse_response = np.asarray(impulse_response, dtype=np.float64)
+        if len(impulse_response) == 0:
+            raise ValueError("the impulse response is empty")
+        if normalize:
+            impulse_response = impulse_response / np.max(np.sqrt(np.sum(impulse_response ** 2, axis=0)))
+        self.impulse_response = impulse_response
+        self.wet = wet
+        self.partition = int(partition)
+
+        partitions = -(-len(impulse_response) // self.partition)
+        padded = np.zeros((partitions * self.partition,) + impulse_response.shape[1:])
+        padded[:len(impulse_response)] = impulse_response
+        padded = padded.reshape((partitions, self.partition) + impulse_response.shape[1:])
+        self.spectra = np.fft.rfft(padded, 2 * self.partition, axis=1)
+        self.reset()
+
+    @classmethod
+    def synthetic(cls, decay=1.2, sample_rate=44100, channels=2, seed=None, damping=6000, wet=0.3,
+                  partition=1024):
+        """Create a reverb whose impulse response is filtered noise decaying by 60 dB over `decay` seconds."""
+        hits = HitBatch(sample_rate, np.full(channels, decay * 1000))
+        time = hits.linspace(0, decay)
+        envelope = np.power(0.001, time / decay)
+        noise = hits.normal(np.random.default_rng(seed), 0, 1)
+        sos = filter_registry.design(2, damping, 'low', fs=sample_rate)
+        impulse_response = sosfilt(sos, hits.finish(noise * envelope))
+        return cls(impulse_response.T, wet, partition)
+
+    @classmethod
+    def from_wav(cls, path, sample_rate=44100, wet=0.3, partition=1024):
+        """Create a reverb with the impulse response in a WAV file, which must have the given sample rate."""
+        rate, impulse_response = wavfile.read(path)
+        if rate != sample_rate:
+            raise ValueError(f"the impulse response has {rate} Hz, expected {sample_rate} Hz")
+        if np.issubdtype(impulse_response.dtype, np.integer):
+            info = np.iinfo(impulse_response.dtype)
+            middle, scale = (info.max + info.min + 1) / 2, (info.max - info.min + 1) / 2
+            impulse_response = (impulse_response.astype(np.float64) - middle) / scale
+        return cls(impulse_response, wet, partition)
+
+    def reset(self):
+        self.history = None
+        self.inputs = None
+
+    def process(self, block):
+        block = np.asarray(block)
+        if block.ndim == 1 and self.impulse_response.ndim == 2:
+            block = block[:, np.newaxis]
+        dtype = np.result_type(block, np.float32)
+        length = self.partition
+        channels = np.broadcast_shapes(block.shape[1:], self.impulse_response.shape[1:])
+        if self.history is None or self.history.shape[1:] != channels:
+            # The current input partition, the spectra of the earlier ones and the overlap of the last output.
+            self.current = np.zeros((length,) + channels)
+            self.filled = 0
+            self.inputs = np.zeros((len(self.spectra) - 1, length + 1) + channels, dtype=complex)
+            self.history = np.zeros((length + 1,) + channels, dtype=complex)
+            self.overlap = np.zeros((length,) + channels)
+            self.head = 0
+            kernel = self.spectra.reshape(self.spectra.shape[:2] + (1,) * (len(channels) - self.spectra.ndim + 2)
+                                          + self.spectra.shape[2:])
+            # The spectra of the earlier partitions form a ring. Pairing slot s of the ring with partition
+            # 1 + (head - s) mod n is a contiguous window of the later partitions reversed and repeated.
+            self.first = kernel[0]
+            self.later = np.concatenate((kernel[:0:-1], kernel[:0:-1]))
+
+        with span('convolution') as stage:
+            output = stage.add(self.convolve(block, channels, dtype))
+        dry = block.astype(dtype, copy=False)
+        return dtype.type(1 - self.wet) * dry + dtype.type(self.wet) * output
+
+    def convolve(self, block, channels, dtype):
+        length = self.partition
+        output = np.empty((len(block),) + channels, dtype=dtype)
+        position = 0
+        while position < len(block):
+            count = min(length - self.filled, len(block) - position)
+            start, stop = self.filled, self.filled + count
+            self.current[start:stop] = block[position:position + count]
+            spectrum = np.fft.rfft(self.current, 2 * length, axis=0)
+            convolved = np.fft.irfft(self.history + spectrum * self.first, 2 * length, axis=0)
+            output[position:position + count] = convolved[start:stop] + self.overlap[start:stop]
+            position += count
+            self.filled = stop
+
+            if self.filled == length:
+                self.overlap = convolved[length:]
+                slots = len(self.inputs)
+                if slots:
+                    self.inputs[self.head] = spectrum
+                    window = self.later[slots - 1 - self.head:2 * slots - 1 - self.head]
+                    self.history = np.einsum('p...,p...->...', self.inputs, window)
+                    self.head = (self.head + 1) % slots
+                self.current[:] = 0
+                self.filled = 0
+        return output
+
+
 class Reverb_apply:
     """
      A class for applying reverb to audio signals.
 
      Methods:
-         apply_reverb(signal, delay, wet, reverb): Apply reverb to an audio signal.
+         apply_reverb(signal, delay, wet, reverb, block_size): Apply reverb to an audio signal.
      """
 
     @staticmethod
-    def apply_reverb(signal, delay, wet, reverb):
-        buffer = Reverb(delay)
-        out_signal = []
-        for i, s in enumerate(signal):
-            if i < delay:
-                sdelay = 0
-            else:
-                sdelay = buffer.dequeue()
-            out_signal.append((1 - wet) * s + wet * sdelay)
-            buffer.enqueue((1 - reverb) * s + reverb * sdelay)
-        return np.array(out_signal)
+    def apply_reverb(signal, delay, wet, reverb, block_size=8192):
+        signal = np.asarray(signal)
+        delay_line = FeedbackDelay(delay, wet, reverb)
+        with span('reverb') as stage:
+            out_signal = stage.add(np.empty(signal.shape, dtype=np.result_type(signal, np.float32)))
+            for start in range(0, len(signal), block_size):
+                stop = start + block_size
+                out_signal[start:stop] = delay_line.process(signal[start:stop])
+        return out_signal
 
 
 class SoundFile:
     """
        A class for generating sound files.
 
+       The files are a content-addressed cache. Each file's entry in a manifest
+       records a hash of its instrument, parameters, duration, sample rate, noise
+       seed, the cache version and the source code of its instrument class and of
+       the shared synthesis code (batches, filters, the voice bank renderer and the
+       int16 conversion). Only files whose hash is
+       missing or out of date are regenerated, in parallel across processes.
+       Files and manifest are written to a temporary file and renamed into place,
+       so concurrent launches never see a partly written file. They get the usual
+       permissions of new files under the umask.
+
        Attributes:
            duration (int): Duration of the sound files.
            sample_rate (int): Sample rate of the sound files.
+           directory (str): Directory of the sound files and the manifest.
+           seed (int): Noise seed of the generated sounds.
+           sounds (list): The (file name, instrument, parameters) of every sound file.
+           cache_version (int): Bump to invalidate every cached file after a change the hash cannot see.
 
        Methods:
-           generate_sound_files(): Generate sound files for various percussion instruments.
+           sample_hash(instrument, params): Return the cache key of a sound file.
+           stale_sounds(): Return the sounds whose files are missing or out of date.
+           generate_sound_files(workers): Regenerate the stale sound files.
        """
 
-    def __init__(self, duration=150):
+    sounds = [
+        ('kick_sound.wav', 'kick', (30,)),
+        ('snare_sound.wav', 'snare', (250,)),
+        ('hi_hat_sound.wav', 'hi_hat', ()),
+        ('open_hat_sound.wav', 'open_hat', ()),
+        ('wood_block_sound.wav', 'wood_block', (880, 2.25, 80)),
+        ('mid_tom_sound.wav', 'mid_tom', (175,)),
+    ]
+    manifest_name = 'manifest.json'
+    cache_version = 1
+
+    def __init__(self, duration=150, directory='generatedSounds', seed=0):
         self.duration = duration
         self.sample_rate = 44100
+        self.directory = directory
+        self.seed = seed
+
+    def sample_hash(self, instrument, params):
+        instrument_class, _ = VoiceBank.renderers[instrument]
+        code = (instrument_class, HitBatch, FilterRegistry, SOSFilter, VoiceBank, to_int16)
+        source = ''.join(inspect.getsource(part) for part in code)
+        key = json.dumps([instrument, list(params), self.duration, self.sample_rate, self.seed, self.cache_version,
+                          source])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, self.manifest_name)) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+
+    def stale_sounds(self):
+        manifest = self.read_manifest()
+        stale = []
+        for file_name, instrument, params in self.sounds:
+            sample_hash = self.sample_hash(instrument, params)
+            path = os.path.join(self.directory, file_name)
+            if manifest.get(file_name) != sample_hash or not os.path.exists(path):
+                stale.append((file_name, instrument, params, sample_hash))
+        return stale
+
+    def generate_sound_files(self, workers=None):
+        os.makedirs(self.directory, exist_ok=True)
+        stale = self.stale_sounds()
+        if not stale:
+            return []
+
+        jobs = [(os.path.join(self.directory, file_name), instrument, params, self.duration, self.sample_rate,
+                 self.seed) for file_name, instrument, params, _ in stale]
+        if len(jobs) == 1 or workers == 1:
+            list(map(SoundFile.write_sound_file, jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(SoundFile.write_sound_file, jobs))
+
+        # Re-read the manifest so entries written by a concurrent launch are kept.
+        manifest = self.read_manifest()
+        manifest.update({file_name: sample_hash for file_name, _, _, sample_hash in stale})
+        self.atomic_write(os.path.join(self.directory, self.manifest_name),
+                          lambda path: self.write_json(path, manifest))
+        return [file_name for file_name, _, _, _ in stale]
 
-    def generate_sound_files(self):
-        kick_sound = Kick().generate_kick_sound(30, self.duration)
-        kick_sound_int16 = (kick_sound * np.iinfo(np.int16).max).astype(np.int16)
-        wavfile.write('generatedSounds/kick_sound.wav', self.sample_rate, kick_sound_int16)
+    @staticmethod
+    def write_sound_file(job):
+        path, instrument, params, duration, sample_rate, seed = job
+        sound = VoiceBank(sample_rate=sample_rate).render(instrument, params, duration, seed)
+        with span('int16') as stage:
+            sound_int16 = stage.add(to_int16(sound))
+        with span('write') as stage:
+            SoundFile.atomic_write(path, lambda temp_path: wavfile.write(temp_path, sample_rate, sound_int16))
+            stage.add(sound_int16)
 
-        snare_sound = Snare().generate_snare_sound(250, self.duration)
-        snare_sound_int16 = (snare_sound * np.iinfo(np.int16).max).astype(np.int16)
-        wavfile.write('generatedSounds/snare_sound.wav', self.sample_rate, snare_sound_int16)
+    @staticmethod
+    def write_json(path, data):
+        with open(path, 'w') as json_file:
+            json.dump(data, json_file, indent=2, sort_keys=True)
 
-        hihat_sound = HiHat().generate_hi_hat(self.duration)
-        hi_hat_sound_int16 = (hihat_sound * np.iinfo(np.int16).max).astype(np.int16)
-        wavfile.write('generatedSounds/hi_hat_sound.wav', self.sample_rate, hi_hat_sound_int16)
+    @staticmethod
+    def atomic_write(path, write):
+        directory, file_name = os.path.split(path)
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix=file_name, suffix='.tmp')
+        os.close(handle)
+        try:
+            write(temp_path)
+            # mkstemp creates the file owner-only, so give it the mode a plain open() would.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+class SampleLibrary:
+    """
+       A lazily loaded library of memory-mapped sample files.
 
-        open_hat_sound = OpenHat().generate_open_hat(self.duration)
-        open_hat_sound_int16 = (open_hat_sound * np.iinfo(np.int16).max).astype(np.int16)
-        wavfile.write('generatedSounds/open_hat_sound.wav', self.sample_rate, open_hat_sound_int16)
+       Creating the library only records the file paths. A sample is memory-mapped
+       the first time it is used, and the raw int16 PCM is used in place without
+       decoding or copying. Cold start therefore stays constant however large the
+       kit is, and processes that map the same files share their pages through
+       the page cache.
 
-        wood_block_sound = WoodBlock().generate_woodblock(880, 2.25, 80, self.duration)
-        woodblock_int16 = (wood_block_sound * np.iinfo(np.int16).max).astype(np.int16)
-        wavfile.write('generatedSounds/wood_block_sound.wav', self.sample_rate, woodblock_int16)
+       Attributes:
+           paths (list): The path of every sample, in index order.
+           sample_rate (int): Sample rate every sample must have.
+           samples (dict): The mapped samples, by path.
 
-        mid_tom_sound = MidTom().generate_mid_tom_sound(175, self.duration)
-        mid_tom_int16 = (mid_tom_sound * np.iinfo(np.int16).max).astype(np.int16)
-        wavfile.write('generatedSounds/mid_tom_sound.wav', self.sample_rate, mid_tom_int16)
+       Methods:
+           from_directory(directory, file_names, sample_rate): Build a library of files in a directory.
+           loaded(): Return the number of samples mapped so far.
+       """
+
+    def __init__(self, paths, sample_rate=44100):
+        self.paths = list(paths)
+        self.sample_rate = sample_rate
+        self.samples = {}
+
+    @classmethod
+    def from_directory(cls, directory, file_names, sample_rate=44100):
+        return cls([os.path.join(directory, file_name) for file_name in file_names], sample_rate)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        path = self.paths[index]
+        sample = self.samples.get(path)
+        if sample is None:
+            sample_rate, sample = wavfile.read(path, mmap=True)
+            if sample_rate != self.sample_rate:
+                raise ValueError(f"{path} has a sample rate of {sample_rate}, expected {self.sample_rate}")
+            self.samples[path] = sample
+        return sample
+
+    def loaded(self):
+        return len(self.samples)
 
 
 if __name__ == '__main__':
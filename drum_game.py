@@ -1,7 +1,12 @@
+import argparse
+import multiprocessing
+import time
+from collections import deque
+import numpy as np
 import pygame
-from pygame import mixer
+from drum_beat import MixBus, Pattern, Sequencer, SampleLibrary, SoundFile
+from playback import StreamEngine
 
-pygame.init()
 WIDTH, HEIGHT = 1400, 800
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -10,138 +15,500 @@ GREEN = (0, 128, 0)
 BLUE = (0, 128, 128)
 RED = (255, 0, 0)
 FPS = 60
-INSTRUMENTS = 6
-BEATS = 8
 BPM = 240
+SAMPLE_RATE = 44100
+MIN_CELL_SIZE = 8
 
-# Pygame initialize
-screen = pygame.display.set_mode([WIDTH, HEIGHT])
-pygame.display.set_caption("Custom Beat Maker")
-clock = pygame.time.Clock()
-label_font = pygame.font.Font('freesansbold.ttf', size=28)
+sound_files = [
+    'kick_sound.wav',
+    'snare_sound.wav',
+    'hi_hat_sound.wav',
+    'open_hat_sound.wav',
+    'wood_block_sound.wav',
+    'mid_tom_sound.wav'
+]
+sound_names = ["Kick", "Snare", "Hi Hat", "Open Hat", "Wood Block", "Mid Tom"]
 
-running = True
-clicked = [[-1 for _ in range(BEATS)] for _ in range(INSTRUMENTS)]
 
-mixer.init()
-sounds = {
-    0: mixer.Sound('generatedSounds/kick_sound.wav'),
-    1: mixer.Sound('generatedSounds/snare_sound.wav'),
-    2: mixer.Sound('generatedSounds/hi_hat_sound.wav'),
-    3: mixer.Sound('generatedSounds/open_hat_sound.wav'),
-    4: mixer.Sound('generatedSounds/wood_block_sound.wav'),
-    5: mixer.Sound('generatedSounds/mid_tom_sound.wav')
-}
+def kit_rows(kit, names, instruments):
+    """
+        Spreads a kit over the rows of the grid.
 
-active_beat = 0
-beat_change = True
-is_playing = True
-active_beat_length = 0
+        Rows beyond the kit reuse it in order, and their labels get a number.
 
+        Args:
+            kit (list): The voices, or the files of the voices, of the kit.
+            names (list): The name of every voice of the kit.
+            instruments (int): The number of rows.
 
-def play_notes():
-    """Plays the notes based on the current beat."""
-    for i in range(INSTRUMENTS):
-        if clicked[i][active_beat] == 1:
-            sounds[i].play()
+        Returns:
+            tuple: The kit entry and the label of every row.
+        """
+    rows = [kit[i % len(kit)] for i in range(instruments)]
+    labels = [names[i % len(kit)] + (f" {i // len(kit) + 1}" if i >= len(kit) else "") for i in range(instruments)]
+    return rows, labels
 
 
-def draw_grid(clicks, beat):
+class BeatMaker:
     """
-        Draws the grid for the beat maker.
+     A class for the pygame beat maker, a grid of instruments by steps that loops while it is edited.
 
-        Args:
-            clicks (list): A 2D list representing the clicks on the grid.
-            beat (int): The active beat.
+     The beat maker is importable and does nothing until run() is called. It
+     takes its voices as arrays, so a caller that has already synthesized them
+     can hand them over directly, and runs either in the calling process or in a
+     BeatMakerWorker. Voices may also be a SampleLibrary, which maps the sample
+     of a row when that row first gets a hit.
 
-        Returns:
-            list: A list of rectangles representing the boxes in the grid.
+     Every column of the grid is pre-mixed into a single stereo buffer on the
+     mix bus, and the loop plays one buffer per step. A click re-mixes only
+     the column it changed, so a dense grid costs the audio callback no more
+     than a sparse one. A change to a strip of the bus, such as mute, solo or
+     set_strip, re-mixes every column and swaps the loop.
+
+     Attributes:
+         voices (sequence): The voice of every row.
+         labels (list): The label of every row.
+         instruments (int): Number of rows of the grid.
+         beats (int): Number of steps of the grid.
+         voice_gain (float): Gain of every voice, 1/32768 for int16 samples.
+         engine (StreamEngine): The engine playing the loop, created on open() unless given.
+         clicked (Pattern): The cells that are switched on.
+         bus (MixBus): The mix bus the columns are mixed on, with one strip per row.
+         columns (list): The pre-mixed buffer of every column, or None for an empty column.
+         active_beat (int): The column under the playhead.
+         is_playing (bool): Whether the transport is running.
+
+     Methods:
+         run(): Open the window and run until it is closed.
+         mix_column(beat): Pre-mix the voices of one column.
+         bus_changed(bus): Re-mix every column after a change to the mix bus.
+         make_sequencer(): Build a sequencer playing the pre-mixed columns.
+         open(): Open the window and start the loop playing.
+         frame(): Handle the events of one frame and repaint what changed.
+         close(): Stop the playback and close the window.
+     """
+
+    def __init__(self, voices, labels, beats=8, voice_gain=1.0, engine=None):
+        self.voices = voices
+        self.labels = labels
+        self.instruments = len(voices)
+        self.beats = beats
+        self.voice_gain = voice_gain
+        self.cell_width = (WIDTH - 200) // beats
+        self.cell_height = (HEIGHT - 200) // self.instruments
+        if min(self.cell_width, self.cell_height) < MIN_CELL_SIZE:
+            raise ValueError(f"a {self.instruments} x {beats} grid does not fit in the window")
+        self.inset = max(1, min(5, self.cell_width // 10, self.cell_height // 10))
+
+        self.clicked = Pattern.empty(self.instruments, beats)
+        self.bus = MixBus()
+        for _ in range(self.instruments):
+            self.bus.add_strip(voice_gain)
+        self.bus.listeners.append(self.bus_changed)
+        self.columns = [None] * beats
+        self.active_beat = 0
+        self.is_playing = True
+        self.running = False
+        self.play_pause = pygame.Rect(30, HEIGHT - 80, 250, 80)
+        self.clear_button = pygame.Rect(1150, HEIGHT - 80, 250, 80)
+        self.frame_times = deque(maxlen=FPS)
+        self.frame_count = 0
+        self.engine = engine
+
+    def mix_column(self, beat):
+        """
+            Pre-mixes the voices of the clicked cells of a column into one stereo buffer.
+
+            Only the voices of the clicked rows are looked up and stacked, and the mix bus
+            mixes them with the strips of those rows in one matrix multiply.
+
+            Args:
+                beat (int): The column to mix.
+
+            Returns:
+                numpy.ndarray: The (samples, 2) buffer of the column, or None if no cell is clicked.
+            """
+        rows = np.flatnonzero(self.clicked.hits[:, beat])
+        if len(rows) == 0:
+            self.columns[beat] = None
+            return None
+        voices = [self.voices[row] for row in rows]
+        stems = np.zeros((len(rows), max(len(voice) for voice in voices)), dtype=self.bus.dtype)
+        for stem, voice in zip(stems, voices):
+            stem[:len(voice)] = voice
+        self.columns[beat] = self.bus.mix(stems, strips=rows)
+        return self.columns[beat]
+
+    def bus_changed(self, bus):
+        """
+            Re-mixes every column that has a clicked cell with the new levels of the mix bus.
+
+            Args:
+                bus (MixBus): The mix bus that changed.
+            """
+        for beat, column in enumerate(self.columns):
+            if column is not None:
+                self.mix_column(beat)
+        if self.engine is not None:
+            self.engine.swap(self.make_sequencer())
+
+    def make_sequencer(self):
+        """
+            Builds a sequencer for the current grid.
+
+            Every column that has a clicked cell is one track, its pre-mixed buffer hit
+            at its own step. The steps are triggered by the audio callback of the stream
+            engine at exact sample positions, so the tempo does not depend on the frame rate.
+
+            Returns:
+                Sequencer: The sequencer playing the clicked cells.
+            """
+        sequencer = Sequencer(SAMPLE_RATE * 60 / BPM, self.beats)
+        for beat, column in enumerate(self.columns):
+            if column is not None:
+                sequencer.add_track(column, [beat])
+        return sequencer
+
+    def open(self):
+        """
+            Opens the window, draws the grid and starts the loop playing.
+            """
+        pygame.init()
+        self.screen = pygame.display.set_mode([WIDTH, HEIGHT])
+        pygame.display.set_caption("Custom Beat Maker")
+        self.clock = pygame.time.Clock()
+        self.label_font = pygame.font.Font('freesansbold.ttf', size=28)
+        self.row_font = pygame.font.Font('freesansbold.ttf', size=min(28, self.cell_height * 2 // 3))
+        self.status_texts = {True: self.label_font.render("Playing", True, WHITE),
+                             False: self.label_font.render("Pause", True, WHITE)}
+        self.status_rect = pygame.Rect(70, HEIGHT - 50, max(text.get_width() for text in self.status_texts.values()),
+                                       self.label_font.get_linesize())
+        self.frame_time_rect = pygame.Rect(500, HEIGHT - 50, 400, self.label_font.get_linesize())
+
+        if self.engine is None:
+            self.engine = StreamEngine(SAMPLE_RATE)
+        self.engine.play(self.make_sequencer(), loop=True)
+
+        self.background = self.build_background()
+        self.screen.blit(self.background, (0, 0))
+        for column in range(self.beats):
+            self.draw_column(column, column == self.active_beat)
+        self.draw_text(self.status_rect, self.status_texts[self.is_playing])
+        pygame.display.flip()
+        self.running = True
+
+    def build_background(self):
+        """
+            Renders the static parts of the window once.
+
+            The labels, grid borders and buttons never change, so they are drawn to an
+            off-screen surface at startup and copied back wherever a part of the
+            window has to be repainted.
+
+            Returns:
+                pygame.Surface: The static background of the window.
+            """
+        surface = pygame.Surface((WIDTH, HEIGHT))
+        surface.fill(BLACK)
+        for i in range(self.instruments):
+            y = i * self.cell_height + self.cell_height
+            pygame.draw.line(surface, RED, (0, y), (200, y), 2)
+
+        for i, label in enumerate(self.labels):
+            text = self.row_font.render(label, True, WHITE)
+            surface.blit(text, (30, i * self.cell_height + min(30, (self.cell_height - text.get_height()) // 2)))
+
+        for i in range(self.beats):
+            for j in range(self.instruments):
+                pygame.draw.rect(surface, BLACK, [i * self.cell_width + 200, (j * self.cell_height), self.cell_width,
+                                                  self.cell_height], 2, 5)
+
+        pygame.draw.rect(surface, GREY, self.play_pause, 0, 5)
+        surface.blit(self.label_font.render('Play and Pause', True, WHITE), (50, HEIGHT - 80))
+        pygame.draw.rect(surface, GREY, self.clear_button, 0, 5)
+        surface.blit(self.label_font.render("Clear Board", True, WHITE), (1160, HEIGHT - 50))
+        return surface
+
+    def cell_rect(self, beat, instrument):
+        """
+            Returns the clickable area of a cell of the grid.
+
+            Args:
+                beat (int): The column of the cell.
+                instrument (int): The row of the cell.
+
+            Returns:
+                pygame.Rect: The filled area of the cell.
+            """
+        return pygame.Rect(beat * self.cell_width + 200 + self.inset, (instrument * self.cell_height) + self.inset,
+                           self.cell_width - 2 * self.inset, self.cell_height - 2 * self.inset)
+
+    def cell_at(self, pos):
         """
-    for i in range(INSTRUMENTS):
-        pygame.draw.line(screen, RED, (0, (i * 100) + 100), (200, (i * 100) + 100), 2)
+            Finds the cell under a point in constant time.
 
-    labels = ["Kick", "Snare", "Hi Hat", "Open Hat", "Wood Block", "Mid Tom"]
-    for i, label in enumerate(labels):
-        text = label_font.render(label, True, WHITE)
-        screen.blit(text, (30, i * 100 + 30))
+            Args:
+                pos (tuple): The (x, y) position on the screen.
 
-    all_box = []
-    for i in range(BEATS):
-        for j in range(INSTRUMENTS):
-            color = GREEN if clicks[j][i] == 1 else GREY
-            rect = pygame.draw.rect(screen, color,
-                                    [i * ((WIDTH - 200) // BEATS) + 205, (j * 100) + 5, ((WIDTH - 200) // BEATS) - 10,
-                                     ((HEIGHT - 200) // INSTRUMENTS) - 10], 0, 3)
-            pygame.draw.rect(screen, BLACK,
-                             [i * ((WIDTH - 200) // BEATS) + 200, (j * 100), ((WIDTH - 200) // BEATS),
-                              ((HEIGHT - 200) // INSTRUMENTS)], 2, 5)
+            Returns:
+                tuple: The (beat, instrument) of the cell, or None if the point is not on a cell.
+            """
+        x, y = pos
+        beat = (x - 200) // self.cell_width
+        instrument = y // self.cell_height
+        if not (x >= 200 and 0 <= beat < self.beats and 0 <= instrument < self.instruments):
+            return None
+        if not self.cell_rect(beat, instrument).collidepoint(pos):
+            return None
+        return beat, instrument
+
+    def draw_column(self, beat, playhead):
+        """
+            Repaints one column of the grid from the cached background.
 
-            all_box.append((rect, (i, j)))
+            Args:
+                beat (int): The column to repaint.
+                playhead (bool): Whether the playhead is on this column.
 
-    pygame.draw.rect(screen, BLUE, [beat * ((WIDTH - 200) // BEATS) + 200, 0, ((WIDTH - 200) // BEATS),
-                                    INSTRUMENTS * 100], 5, 3)
+            Returns:
+                pygame.Rect: The area of the screen that changed.
+            """
+        column = pygame.Rect(beat * self.cell_width + 200, 0, self.cell_width, self.instruments * self.cell_height)
+        self.screen.blit(self.background, column, column)
+        for j in range(self.instruments):
+            pygame.draw.rect(self.screen, GREEN if self.clicked.hits[j, beat] else GREY, self.cell_rect(beat, j), 0, 3)
+        if playhead:
+            pygame.draw.rect(self.screen, BLUE, column, self.inset, 3)
+        return column
 
-    return all_box
+    def draw_cell(self, beat, instrument):
+        """
+            Repaints a single cell after it was toggled.
 
+            Args:
+                beat (int): The column of the cell.
+                instrument (int): The row of the cell.
 
-while running:
-    clock.tick(FPS)
-    screen.fill(BLACK)
+            Returns:
+                pygame.Rect: The area of the screen that changed.
+            """
+        if beat == self.active_beat:
+            # The playhead outline touches every cell of its column.
+            return self.draw_column(beat, True)
+        rect = self.cell_rect(beat, instrument)
+        pygame.draw.rect(self.screen, GREEN if self.clicked.hits[instrument, beat] else GREY, rect, 0, 3)
+        return rect
 
-    total_box = draw_grid(clicked, active_beat)
+    def draw_text(self, rect, text):
+        """
+            Replaces the contents of a text area of the window.
 
-    # Play and Pause
-    play_pause = pygame.draw.rect(screen, GREY, [30, HEIGHT - 80, 250, 80], 0, 5)
-    play_text = label_font.render('Play and Pause', True, WHITE)
-    screen.blit(play_text, (50, HEIGHT - 80))
+            Args:
+                rect (pygame.Rect): The area to repaint.
+                text (pygame.Surface): The rendered text.
 
-    if is_playing:
-        play_text_2 = label_font.render("Playing", True, WHITE)
-    else:
-        play_text_2 = label_font.render("Pause", True, WHITE)
+            Returns:
+                pygame.Rect: The area of the screen that changed.
+            """
+        self.screen.blit(self.background, rect, rect)
+        self.screen.blit(text, rect.topleft)
+        return rect
 
-    screen.blit(play_text_2, (70, HEIGHT - 50))
+    def handle_event(self, event):
+        """
+            Applies one pygame event to the grid and the transport.
 
-    clear_button = pygame.draw.rect(screen, GREY, [1150, HEIGHT - 80, 250, 80], 0, 5)
-    clear_text = label_font.render("Clear Board", True, WHITE)
-    screen.blit(clear_text, (1160, HEIGHT - 50))
-    if beat_change:
-        play_notes()
-        beat_change = False
+            Args:
+                event (pygame.event.Event): The event to handle.
 
-    for event in pygame.event.get():
+            Returns:
+                list: The areas of the screen that changed.
+            """
+        dirty_rects = []
         if event.type == pygame.QUIT:
-            running = False
+            self.running = False
 
         if event.type == pygame.MOUSEBUTTONDOWN:
             # Toggle button state when clicked
-            for box, coordinates in total_box:
-                if box.collidepoint(event.pos):
-                    x, y = coordinates
-                    clicked[y][x] *= -1
+            cell = self.cell_at(event.pos)
+            if cell is not None:
+                x, y = cell
+                self.clicked.toggle(y, x)
+                self.mix_column(x)
+                self.engine.swap(self.make_sequencer())
+                dirty_rects.append(self.draw_cell(x, y))
 
         if event.type == pygame.MOUSEBUTTONUP:
-            if play_pause.collidepoint(event.pos):
-                if is_playing:
-                    is_playing = False
-                elif not is_playing:
-                    is_playing = True
-
-            elif clear_button.collidepoint(event.pos):
-                clicked = [[-1 for _ in range(BEATS)] for _ in range(INSTRUMENTS)]
-
-    beat_len = 3600 // BPM
-    if is_playing:
-        if active_beat_length < beat_len:
-            active_beat_length += 1
-        else:
-            active_beat_length = 0
-            if active_beat < BEATS - 1:
-                active_beat += 1
-                beat_change = True
-            else:
-                active_beat = 0
-                beat_change = True
-    pygame.display.flip()
-
-pygame.quit()
+            if self.play_pause.collidepoint(event.pos):
+                if self.is_playing:
+                    self.is_playing = False
+                    self.engine.pause()
+                elif not self.is_playing:
+                    self.is_playing = True
+                    self.engine.resume()
+                dirty_rects.append(self.draw_text(self.status_rect, self.status_texts[self.is_playing]))
+
+            elif self.clear_button.collidepoint(event.pos):
+                self.clicked.clear()
+                self.columns = [None] * self.beats
+                self.engine.swap(self.make_sequencer())
+                dirty_rects.extend(self.draw_column(column, column == self.active_beat)
+                                   for column in range(self.beats))
+        return dirty_rects
+
+    def frame(self):
+        """
+            Handles the events of one frame and repaints the parts of the window that changed.
+            """
+        self.clock.tick(FPS)
+        frame_start = time.perf_counter()
+        dirty_rects = []
+
+        for event in pygame.event.get():
+            dirty_rects.extend(self.handle_event(event))
+
+        # The audio callback advances the steps, the render loop only displays them.
+        beat = max(self.engine.current_step, 0)
+        if beat != self.active_beat:
+            dirty_rects.append(self.draw_column(self.active_beat, False))
+            self.active_beat = beat
+            dirty_rects.append(self.draw_column(self.active_beat, True))
+
+        self.frame_count += 1
+        if self.frame_count % (FPS // 2) == 0:
+            frame_time = 1000 * sum(self.frame_times) / len(self.frame_times)
+            text = self.label_font.render(f"Frame: {frame_time:.2f} ms", True, WHITE)
+            dirty_rects.append(self.draw_text(self.frame_time_rect, text))
+
+        pygame.display.update(dirty_rects)
+        self.frame_times.append(time.perf_counter() - frame_start)
+
+    def close(self):
+        """
+            Stops the playback and closes the window.
+            """
+        if self.engine is not None:
+            self.engine.stop()
+        pygame.quit()
+
+    def run(self):
+        """
+            Opens the window and runs the beat maker until the window is closed.
+            """
+        self.open()
+        try:
+            while self.running:
+                self.frame()
+        finally:
+            self.close()
+
+
+def serve(connection):
+    """
+        Runs a beat maker for every request received on a connection.
+
+        Pygame is initialized before the first request arrives, so a request only
+        has to open the window. A request of None, or a closed connection, ends
+        the worker.
+
+        Args:
+            connection (multiprocessing.connection.Connection): The worker end of the pipe.
+        """
+    pygame.init()
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        voices, labels, beats, voice_gain = request
+        BeatMaker(voices, labels, beats, voice_gain).run()
+
+
+class BeatMakerWorker:
+    """
+     A class for a beat maker process that is started ahead of time.
+
+     The worker imports pygame and the audio stack when it starts and then waits.
+     Launching a beat maker sends it the voices themselves, so opening the window
+     involves no new interpreter, no sample files and no synthesis. The worker is
+     always spawned, never forked, since PortAudio and SDL in the caller are not
+     fork-safe. Pygame needs the main thread, so the worker is also the only way
+     to run a beat maker next to another GUI toolkit.
+
+     Methods:
+         start(): Start the worker process.
+         launch(voices, labels, beats, voice_gain): Open a beat maker in the worker.
+         stop(): End the worker process.
+     """
+
+    def __init__(self):
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        """
+            Starts the worker process and waits for it in the background.
+            """
+        context = multiprocessing.get_context('spawn')
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=serve, args=(worker_connection,), daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+    def launch(self, voices, labels, beats=8, voice_gain=1.0):
+        """
+            Opens a beat maker in the worker, restarting the worker if it has exited.
+
+            A launch while a beat maker is still open is queued until that window closes.
+
+            Args:
+                voices (list): The voice of every row, as arrays.
+                labels (list): The label of every row.
+                beats (int): The number of steps of the grid.
+                voice_gain (float): The gain of every voice.
+            """
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.connection.send(([np.asarray(voice) for voice in voices], labels, beats, voice_gain))
+
+    def stop(self):
+        """
+            Ends the worker process, closing its window if one is open.
+            """
+        if self.process is None:
+            return
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.connection.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+
+def main(argv=None):
+    # The grid size is chosen at launch, everything else is laid out from it.
+    parser = argparse.ArgumentParser(description="Custom Beat Maker")
+    parser.add_argument("-i", "--instruments", type=int, default=6, help="number of rows in the grid")
+    parser.add_argument("-b", "--beats", type=int, default=8, help="number of steps in the grid")
+    args = parser.parse_args(argv)
+
+    # Only missing or outdated sample files are regenerated.
+    SoundFile().generate_sound_files()
+    # Samples are memory-mapped when a row first gets a hit.
+    row_files, labels = kit_rows(sound_files, sound_names, args.instruments)
+    voices = SampleLibrary.from_directory('generatedSounds', row_files, SAMPLE_RATE)
+    try:
+        beat_maker = BeatMaker(voices, labels, args.beats, voice_gain=1 / -np.iinfo(np.int16).min)
+    except ValueError as error:
+        parser.error(str(error))
+    beat_maker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 import tkinter as tk
 import sounddevice as sd
 from drum_beat import *
-from threading import Thread
-import subprocess
-import os
+from playback import StreamEngine
+from render_queue import RenderQueue
+import sys
+from drum_game import BeatMakerWorker, kit_rows, sound_names
+from profiling import RenderProfile
 
 
 class DrumMachine:
@@ -12,7 +14,12 @@ class DrumMachine:
 
      This application allows users to play different drum beats, including random beats
      and beats with reverb effect. It also provides an option to open a Pygame window
-     for additional drum interaction.
+     for additional drum interaction. A RenderQueue renders beats in the background,
+     so a button starts a beat that is already rendered and the window never waits
+     for a render. Beats are streamed through a StreamEngine. The Pygame beat maker
+     runs in a spawned worker process that is started with the application, since
+     pygame cannot share the main thread with Tk, and gets its voices straight
+     from the voice bank.
 
      Methods:
          setup_gui(): Set up the graphical user interface.
@@ -21,11 +28,16 @@ class DrumMachine:
          play_reverb(): Play a beat with reverb effect.
          stop_beat(): Stop playing the beat.
          open_pygame_window(): Open a Pygame window for additional drum interaction.
+         next_beat(variant): Take a rendered beat, profiling a fresh render if the profile is shown.
          quit(): Quit the application.
      """
 
-    def __init__(self):
-        """Initialize the DrumMachine."""
+    def __init__(self, queue_depth=2, queue_max_bytes=64 * 1024 * 1024, render_workers=1):
+        """Initialize the DrumMachine with the render queue settings."""
+        # The beat maker worker is spawned first, so it is importing pygame while Tk starts up.
+        self.beat_maker = BeatMakerWorker()
+        self.beat_maker.start()
+
         self.root = tk.Tk()
         self.root.title("Rhythmic Forge")
 
@@ -41,7 +53,11 @@ class DrumMachine:
 
         self.duration = 150
         self.samplerate = 44100
+        self.engine = StreamEngine(self.samplerate)
+        self.render_queue = RenderQueue(queue_depth, queue_max_bytes, render_workers)
+        self.render_queue.start()
         self.setup_gui()
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
         self.root.mainloop()
         # self.generate_beat = GenerateBeat()
 
@@ -64,71 +80,65 @@ class DrumMachine:
 
         tk.Button(self.root, text="Quit", command=self.quit).pack(pady=5)
 
+        self.show_profile = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.root, text="Show render profile", variable=self.show_profile).pack(pady=5)
+
+        self.profile_label = tk.Label(self.root, text="", font=("Courier", 9), justify=tk.LEFT)
+        self.profile_label.pack(pady=5)
+
     def play_beat_1(self):
         """Play the first random beat."""
 
-        generate_beat = GenerateBeat(repetition=2)
-        beat1, beat2 = generate_beat.generate_sound()
-        sd.play(beat1, self.samplerate)
+        self.engine.play(self.next_beat('groove'))
 
     def play_beat_2(self):
         """Play the second random beat."""
 
-        generate_beat = GenerateBeat(repetition=2)
-        beat1, beat2 = generate_beat.generate_sound()
-        sd.play(beat2.astype(np.int16), self.samplerate)
+        self.engine.play(self.next_beat('storm'))
 
     def play_reverb(self):
         """Play the reverb beat."""
 
-        generate_beat = GenerateBeat(repetition=2)
-        beat1, beat2 = generate_beat.generate_sound()
-        reverb_delay = 100
-        wetness = 0.5
-        reverb_strength = 0.1
-        reverb_sound = Reverb_apply()
-        reverb_beat = reverb_sound.apply_reverb(beat1, reverb_delay, wetness, reverb_strength)
-        sd.play(reverb_beat, self.samplerate)
+        self.engine.play(self.next_beat('reverb'))
 
     def play_reverb_2(self):
         """Play the reverb beat."""
-        generate_beat = GenerateBeat(repetition=2)
-        beat1, beat2 = generate_beat.generate_sound()
-        reverb_delay = 100
-        wetness = 0.5
-        reverb_strength = 0.1
-        reverb_sound = Reverb_apply()
-        reverb_beat = reverb_sound.apply_reverb(beat2, reverb_delay, wetness, reverb_strength)
-        sd.play(reverb_beat.astype(np.int16), self.samplerate)
+        self.engine.play(self.next_beat('reverb_storm'))
 
     def stop_beat(self):
         """Stop playing the beat."""
 
+        self.engine.stop()
         sd.stop()
 
     def open_pygame_window(self):
         """Open the Pygame window."""
 
-        if not os.path.exists("generatedSounds"):
-            os.makedirs("generatedSounds")
+        # The same hits as the generated sound files, taken from the voice bank instead of from disk.
+        sound_file = SoundFile(self.duration)
+        kit = [default_voice_bank.get(instrument, params, sound_file.duration, seed=sound_file.seed)
+               for _, instrument, params in sound_file.sounds]
+        voices, labels = kit_rows(kit, sound_names, len(kit))
+        self.beat_maker.launch(voices, labels)
 
-        required_sounds = [
-            "generatedSounds/kick_sound.wav",
-            "generatedSounds/snare_sound.wav",
-            "generatedSounds/hi_hat_sound.wav",
-            "generatedSounds/open_hat_sound.wav",
-            "generatedSounds/wood_block_sound.wav",
-            "generatedSounds/mid_tom_sound.wav"
-        ]
-        missing_sounds = [sound for sound in required_sounds if not os.path.exists(sound)]
+    def next_beat(self, variant):
+        """Return a rendered beat of a variant, showing a render profile if it is enabled."""
 
-        if missing_sounds:
-            sound_file = SoundFile()
-            sound_file.generate_sound_files()
+        if not self.show_profile.get():
+            return self.render_queue.get(variant)
 
-        subprocess.Popen(["python", "drum_game.py"])
+        # Queued beats were rendered on another thread, so profile a fresh render instead.
+        with RenderProfile() as profile:
+            audio = self.render_queue.render(variant)
+        summary = profile.summary()
+        self.profile_label.config(text=summary)
+        print(summary, file=sys.stderr)
+        return RenderQueue.as_sequencer(audio)
 
     def quit(self):
         """Quit the application."""
 
+        self.render_queue.stop()
+        self.beat_maker.stop()
+        self.engine.stop()
         self.root.destroy()
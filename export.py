@@ -0,0 +1,376 @@
+import hashlib
+import os
+import wave
+from abc import ABC, abstractmethod
+import numpy as np
+from profiling import span
+
+CRC16_BLOCK = 64
+
+
+def crc8_table():
+    """Return the lookup table of the CRC-8 (polynomial x^8 + x^2 + x + 1) used in FLAC frame headers."""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+def crc16_tables():
+    """Return the byte table of the FLAC frame CRC-16 (polynomial 0x8005) and the tables shifting a CRC by a block."""
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+
+    def shift(crc):
+        for _ in range(CRC16_BLOCK):
+            crc = ((crc << 8) & 0xFFFF) ^ table[crc >> 8]
+        return crc
+
+    return (np.array(table, dtype=np.int64), [shift(byte << 8) for byte in range(256)],
+            [shift(byte) for byte in range(256)])
+
+
+CRC8_TABLE = crc8_table()
+CRC16_TABLE, CRC16_SHIFT_HIGH, CRC16_SHIFT_LOW = crc16_tables()
+
+
+def crc8(data):
+    """Return the CRC-8 of a FLAC frame header."""
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def crc16(data):
+    """
+    Return the CRC-16 of a FLAC frame.
+
+    The CRC starts at zero, so leading zero bytes do not change it and the
+    data can be padded to whole blocks. The CRCs of all blocks are computed
+    side by side with NumPy, one byte column at a time, and then chained by
+    shifting the running CRC over one block with two table lookups.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    padding = np.zeros(-len(data) % CRC16_BLOCK, dtype=np.uint8)
+    blocks = np.concatenate((padding, data)).reshape(-1, CRC16_BLOCK)
+    block_crcs = np.zeros(len(blocks), dtype=np.int64)
+    for column in blocks.T:
+        block_crcs = ((block_crcs << 8) & 0xFFFF) ^ CRC16_TABLE[(block_crcs >> 8) ^ column]
+    crc = 0
+    for block_crc in block_crcs.tolist():
+        crc = CRC16_SHIFT_HIGH[crc >> 8] ^ CRC16_SHIFT_LOW[crc & 0xFF] ^ block_crc
+    return crc
+
+
+def pack_bits(values, widths):
+    """Return the bits of unsigned fields of the given widths, most significant bit first, as a uint8 array."""
+    values = np.asarray(values, dtype=np.int64)[:, np.newaxis]
+    widths = np.asarray(widths, dtype=np.int64)[:, np.newaxis]
+    # Lay the fields out as rows as wide as the widest field and keep the bits inside each field.
+    shifts = widths - 1 - np.arange(widths.max() if len(widths) else 0)
+    return ((values >> np.maximum(shifts, 0)) & 1)[shifts >= 0].astype(np.uint8)
+
+
+def rice_bits(folded, parameter):
+    """Return the Rice codes of folded residuals as a uint8 bit array: the quotient in unary, then `parameter` bits."""
+    quotients = folded >> parameter
+    ends = np.cumsum(quotients + 1 + parameter)
+    bits = np.zeros(ends[-1] if len(ends) else 0, dtype=np.uint8)
+    # The unary quotient is zeros ended by a one, followed by the low bits of the residual.
+    low = ends - parameter
+    bits[low - 1] = 1
+    for position in range(parameter):
+        bits[low + position] = (folded >> (parameter - 1 - position)) & 1
+    return bits
+
+
+def quantize(signal, bits=16, dither=False, rng=None):
+    """
+    Scale a float signal in [-1, 1] to signed `bits`-bit integers, clipping anything louder.
+
+    With dither, triangular (TPDF) noise of one step peak is added and the
+    samples are rounded, which turns the quantization error into a constant
+    noise floor. Without, the samples are truncated exactly like to_int16.
+    """
+    full_scale = 2 ** (bits - 1) - 1
+    scaled = np.multiply(signal, full_scale, dtype=np.float64)
+    if dither:
+        rng = rng if rng is not None else np.random.default_rng()
+        scaled = np.round(scaled + rng.random(scaled.shape) - rng.random(scaled.shape))
+    return np.clip(scaled, -full_scale - 1, full_scale).astype(np.int16 if bits == 16 else np.int32)
+
+
+def pcm_bytes(samples, bits):
+    """Return integer samples as interleaved little-endian PCM bytes of `bits` bits."""
+    if bits == 16:
+        return samples.astype('<i2').tobytes()
+    return samples.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+class PcmWriter(ABC):
+    """
+     An abstract base class for writing float chunks to a file as 16 or 24-bit integer PCM.
+
+     Every chunk is quantized as it arrives, optionally with dither, so only the
+     current chunk is ever held in memory. The dither noise comes from a seeded
+     generator, so the same seed always writes the same file.
+
+     Attributes:
+         path (str): Path of the file.
+         sample_rate (int): Sample rate of the file.
+         channels (int): Number of channels of the file.
+         bits (int): Bits per sample, 16 or 24.
+         dither (bool): Whether TPDF dither is added before rounding.
+         frames (int): Number of frames written so far.
+
+     Methods:
+         write(chunk): Append a float chunk to the file.
+         write_samples(samples): Append integer samples to the file, implemented by every writer.
+         close(): Finish and close the file.
+     """
+
+    def __init__(self, path, sample_rate=44100, channels=2, bits=16, dither=False, seed=None):
+        """Check the sample format and set up the dither generator."""
+        if bits not in (16, 24):
+            raise ValueError("bits must be 16 or 24")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bits = bits
+        self.dither = dither
+        self.rng = np.random.default_rng(seed)
+        self.frames = 0
+
+    def write(self, chunk):
+        """Quantize a float chunk of shape (frames,) or (frames, channels) and append it to the file."""
+        chunk = np.asarray(chunk)
+        with span('int16') as stage:
+            samples = stage.add(quantize(chunk, self.bits, self.dither, self.rng).reshape(len(chunk), self.channels))
+        with span('write') as stage:
+            self.write_samples(stage.add(samples))
+        self.frames += len(chunk)
+
+    @abstractmethod
+    def write_samples(self, samples):
+        """Append integer samples of shape (frames, channels) to the file."""
+
+    @abstractmethod
+    def close(self):
+        """Finish and close the file."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class WavWriter(PcmWriter):
+    """
+     A class for writing a PCM WAV file one chunk at a time.
+
+     The header is written up front and its sizes are filled in when the file is
+     closed, so the length of the audio does not have to be known in advance.
+     """
+
+    def __init__(self, path, sample_rate=44100, channels=2, bits=16, dither=False, seed=None):
+        """Create the file and write a header for an empty stream."""
+        super().__init__(path, sample_rate, channels, bits, dither, seed)
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(bits // 8)
+        self.file.setframerate(sample_rate)
+
+    def write_samples(self, samples):
+        """Append integer samples to the data chunk."""
+        self.file.writeframes(pcm_bytes(samples, self.bits))
+
+    def close(self):
+        """Finish the header and close the file."""
+        self.file.close()
+
+
+class FlacWriter(PcmWriter):
+    """
+     A class for writing a FLAC file one chunk at a time, with an encoder written in NumPy.
+
+     Samples are collected into fixed-size blocks and every block is written as a
+     frame as soon as it is full. Each channel of a frame is stored as a constant,
+     as verbatim samples, or as the residual of the best fixed polynomial
+     predictor (orders 0 to 4) in a single Rice partition, whichever is smallest.
+     Stereo frames also try left/side, side/right and mid/side decorrelation. The
+     subframe type, predictor order and stereo mode are chosen from computed sizes
+     alone, and only the winning subframes are encoded, with their bits packed
+     by vectorized operations. The stream
+     info block, with the total length and the MD5 of the audio, is rewritten when
+     the file is closed.
+
+     Attributes:
+         block_size (int): Number of frames per FLAC frame.
+     """
+
+    block_size_codes = {192: 1, 576: 2, 1152: 3, 2304: 4, 4608: 5, 256: 8, 512: 9, 1024: 10, 2048: 11, 4096: 12,
+                        8192: 13, 16384: 14, 32768: 15}
+    sample_size_codes = {16: 0b100, 24: 0b110}
+    stereo_assignments = {0b0001: ('left', 'right'), 0b1000: ('left', 'side'), 0b1001: ('side', 'right'),
+                          0b1010: ('mid', 'side')}
+
+    def __init__(self, path, sample_rate=44100, channels=2, bits=16, dither=False, seed=None, block_size=4096):
+        """Create the file and write a placeholder stream info block."""
+        super().__init__(path, sample_rate, channels, bits, dither, seed)
+        if not 16 <= block_size <= 65535:
+            raise ValueError("block_size must be between 16 and 65535")
+        self.block_size = block_size
+        self.buffer = np.zeros((0, channels), dtype=np.int64)
+        self.frame_number = 0
+        self.min_frame_bytes = None
+        self.max_frame_bytes = 0
+        self.md5 = hashlib.md5()
+        self.file = open(path, 'wb')
+        self.file.write(b'fLaC')
+        self.file.write(self.stream_info(0, b'\0' * 16))
+
+    def stream_info(self, total_frames, md5):
+        """Return the stream info metadata block, marked as the last metadata block."""
+        values = [0x80, 34, self.block_size, self.block_size, self.min_frame_bytes or 0, self.max_frame_bytes,
+                  self.sample_rate, self.channels - 1, self.bits - 1, total_frames]
+        widths = [8, 24, 16, 16, 24, 24, 20, 3, 5, 36]
+        return np.packbits(pack_bits(values, widths)).tobytes() + md5
+
+    def write_samples(self, samples):
+        """Buffer samples and encode every full block."""
+        self.md5.update(pcm_bytes(samples, self.bits))
+        self.buffer = np.concatenate((self.buffer, samples))
+        full = len(self.buffer) // self.block_size * self.block_size
+        for start in range(0, full, self.block_size):
+            self.write_frame(self.buffer[start:start + self.block_size])
+        self.buffer = self.buffer[full:]
+
+    def write_frame(self, block):
+        """Encode one block of samples as a frame and append it to the file."""
+        frame = self.encode_frame(block)
+        self.file.write(frame)
+        self.min_frame_bytes = min(self.min_frame_bytes or len(frame), len(frame))
+        self.max_frame_bytes = max(self.max_frame_bytes, len(frame))
+        self.frame_number += 1
+
+    def encode_frame(self, block):
+        """Return the bytes of a frame holding a block of samples."""
+        block = block.astype(np.int64)
+        length = len(block)
+        if self.channels == 2:
+            left, right = block[:, 0], block[:, 1]
+            signals = {'left': (left, self.bits), 'right': (right, self.bits), 'side': (left - right, self.bits + 1),
+                       'mid': ((left + right) >> 1, self.bits)}
+            plans = {name: self.plan_subframe(*signal) for name, signal in signals.items()}
+            assignment, names = min(self.stereo_assignments.items(),
+                                    key=lambda item: sum(plans[name][0] for name in item[1]))
+            bits = np.concatenate([self.encode_subframe(*signals[name], plans[name]) for name in names])
+        else:
+            assignment = self.channels - 1
+            channels = [block[:, channel] for channel in range(self.channels)]
+            bits = np.concatenate([self.encode_subframe(signal, self.bits, self.plan_subframe(signal, self.bits))
+                                   for signal in channels])
+
+        block_size_code = self.block_size_codes.get(length, 7) if length == self.block_size else 7
+        values = [0x3FFE, 0, 0, block_size_code, 0, assignment, self.sample_size_codes[self.bits], 0]
+        widths = [14, 1, 1, 4, 4, 4, 3, 1]
+        header = np.packbits(pack_bits(values, widths)).tobytes() + self.utf8_number(self.frame_number)
+        if block_size_code == 7:
+            header += (length - 1).to_bytes(2, 'big')
+        header += bytes([crc8(header)])
+
+        frame = header + np.packbits(bits).tobytes()
+        return frame + crc16(frame).to_bytes(2, 'big')
+
+    @staticmethod
+    def utf8_number(number):
+        """Return a frame number in the extended UTF-8 coding of FLAC frame headers."""
+        if number < 0x80:
+            return bytes([number])
+        length = 2
+        # A sequence of `length` bytes carries 7 - length bits in the first byte (none for 7) and 6 in every other.
+        while number >= 1 << (6 * (length - 1) + (7 - length if length < 7 else 0)):
+            length += 1
+        first = ((0xFF << (8 - length)) & 0xFF) | (number >> (6 * (length - 1)))
+        rest = [0x80 | ((number >> (6 * i)) & 0x3F) for i in range(length - 2, -1, -1)]
+        return bytes([first] + rest)
+
+    def plan_subframe(self, signal, bits):
+        """
+        Return the size in bits, the type and the coding of the smallest subframe for a channel of a block.
+
+        Only sizes are computed here. The type is 'constant', 'verbatim' or 'fixed',
+        and a fixed subframe also gets its predictor order, folded residual and Rice
+        parameter, which encode_subframe() turns into bits.
+        """
+        if np.all(signal == signal[0]):
+            return 8 + bits, 'constant', None
+
+        best = (8 + len(signal) * bits, 'verbatim', None)
+        residual = signal
+        for order in range(min(4, len(signal) - 1) + 1):
+            residual = np.diff(residual) if order else residual
+            # Fold signed residuals to unsigned ones, 0, -1, 1, -2, ... to 0, 1, 2, 3, ...
+            folded = (residual << 1) ^ (residual >> 63)
+            parameter, size = self.rice_parameter(folded)
+            size += 8 + order * bits + 2 + 4 + (4 if parameter < 15 else 5)
+            if size < best[0]:
+                best = (size, 'fixed', (order, folded, parameter))
+        return best
+
+    @staticmethod
+    def rice_parameter(folded):
+        """Return the best Rice parameter of a folded residual and the size of its codes in bits."""
+        total = int(np.add.reduce(folded))
+        guess = (total // len(folded)).bit_length() - 1 if total >= len(folded) else 0
+        candidates = range(max(guess - 1, 0), min(guess + 1, 30) + 1)
+        sizes = {parameter: len(folded) * (parameter + 1) + int(np.add.reduce(folded >> parameter))
+                 for parameter in candidates}
+        parameter = min(sizes, key=sizes.get)
+        return parameter, sizes[parameter]
+
+    @staticmethod
+    def encode_subframe(signal, bits, plan):
+        """Return the bits of a subframe holding a channel of a block, as planned by plan_subframe()."""
+        mask = (1 << bits) - 1
+        _, kind, coding = plan
+        if kind == 'constant':
+            return pack_bits([0, int(signal[0]) & mask], [8, bits])
+        if kind == 'verbatim':
+            return pack_bits(np.concatenate(([0b00000010], signal & mask)), [8] + [bits] * len(signal))
+
+        order, folded, parameter = coding
+        parameter_bits = 4 if parameter < 15 else 5
+        values = np.concatenate(([(0b001000 | order) << 1], signal[:order] & mask, [parameter_bits - 4, 0, parameter]))
+        widths = np.concatenate(([8], [bits] * order, [2, 4, parameter_bits]))
+        return np.concatenate((pack_bits(values, widths), rice_bits(folded, parameter)))
+
+    def close(self):
+        """Encode the last, shorter block and rewrite the stream info block with the final length and MD5."""
+        if len(self.buffer):
+            self.write_frame(self.buffer)
+            self.buffer = self.buffer[:0]
+        self.file.seek(4)
+        self.file.write(self.stream_info(self.frames, self.md5.digest()))
+        self.file.close()
+
+
+writers = {'.wav': WavWriter, '.flac': FlacWriter}
+
+
+def write_chunks(path, chunks, sample_rate=44100, channels=2, bits=16, dither=False, seed=None):
+    """Write an iterable of float chunks to a WAV or FLAC file, by extension, and return the frames written."""
+    writer_class = writers[os.path.splitext(path)[1].lower()]
+    with writer_class(path, sample_rate, channels, bits, dither, seed) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.frames
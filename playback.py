@@ -0,0 +1,382 @@
+import queue
+import threading
+import numpy as np
+import sounddevice as sd
+
+
+class NullStream:
+    """
+     A stand-in for sd.OutputStream that never touches an audio device.
+
+     The stream is driven by hand with pull(), which calls the engine callback
+     the same way the audio thread would. This lets the streaming engine run
+     headless, for example in tests.
+
+     Methods:
+         start(): Mark the stream as active.
+         stop(): Mark the stream as inactive.
+         close(): Close the stream.
+         pull(blocks): Request the next blocks of audio from the callback.
+     """
+
+    def __init__(self, samplerate, blocksize, channels, dtype, callback):
+        """Initialize the stream with the same arguments as sd.OutputStream."""
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.dtype = dtype
+        self.callback = callback
+        self.active = False
+
+    def start(self):
+        """Mark the stream as active."""
+        self.active = True
+
+    def stop(self):
+        """Mark the stream as inactive."""
+        self.active = False
+
+    def close(self):
+        """Close the stream."""
+        self.active = False
+
+    def pull(self, blocks=1):
+        """Request the next blocks of audio and return them as one array."""
+        out = np.zeros((blocks * self.blocksize, self.channels), dtype=self.dtype)
+        for i in range(blocks):
+            if not self.active:
+                return out[:i * self.blocksize]
+            try:
+                self.callback(out[i * self.blocksize:(i + 1) * self.blocksize], self.blocksize, None, None)
+            except sd.CallbackStop:
+                self.active = False
+                return out[:(i + 1) * self.blocksize]
+        return out
+
+
+class ChunkFeeder:
+    """
+     A background thread that pulls chunks from an iterable ahead of the audio callback.
+
+     Pulling a chunk may do real work, such as running effects on it. The feeder
+     does that work on its own thread and keeps up to `depth` chunks ready in a
+     bounded queue, so the callback only takes a finished chunk and copies it.
+
+     Attributes:
+         depth (int): Number of chunks kept ready.
+         done (bool): Whether the last chunk has been taken.
+
+     Methods:
+         get(): Return the next chunk, or None once the iterable is exhausted.
+         stop(): Stop pulling chunks.
+     """
+
+    def __init__(self, chunks, depth=4):
+        """Start pulling chunks from an iterable on a daemon thread."""
+        self.depth = depth
+        self.done = False
+        self.queue = queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.feed, args=(iter(chunks),), daemon=True)
+        self.thread.start()
+
+    def feed(self, chunks):
+        """Put every chunk into the queue, then None, until stopped."""
+        try:
+            for chunk in chunks:
+                if not self.put(chunk):
+                    return
+        finally:
+            self.put(None)
+
+    def put(self, item):
+        """Wait for room in the queue, and return False if the feeder was stopped first."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self):
+        """Return the next chunk, or None once the iterable is exhausted."""
+        if self.done:
+            return None
+        chunk = self.queue.get()
+        self.done = chunk is None
+        return chunk
+
+    def stop(self):
+        """Stop pulling chunks. Chunks already in the queue are dropped."""
+        self.stopped.set()
+
+
+class StreamEngine:
+    """
+     A streaming playback engine that renders audio just in time in an output stream callback.
+
+     The engine keeps the state of a sequencer (stereo voices, the steps they hit
+     and the step length) and renders only the block the audio device asks for.
+     Playback starts as soon as the first block is ready, however long the pattern
+     is. Pattern swaps and tempo changes are picked up at the next block boundary.
+     Steps start at exact sample positions, and the step length may be fractional.
+     The engine listens to the mix bus of the sequencer it plays, so a change to
+     a strip, such as mute or solo, is swapped in at the next block boundary.
+     The engine can also stream any iterable of stereo chunks, such as
+     GenerateBeat.generate_chunks(). A ChunkFeeder pulls them on its own thread,
+     a few chunks ahead, so effects applied to the chunks never run in the callback.
+
+     Attributes:
+         sample_rate (int): Sample rate of the output stream.
+         blocksize (int): Number of frames rendered per callback.
+         feed_depth (int): Number of chunks kept ready when streaming chunks.
+         stream_factory (callable): Creates the output stream, sd.OutputStream by default.
+         current_step (int): The step that started most recently, or -1 before the first step.
+         paused (bool): Whether the transport is on hold.
+
+     Methods:
+         play(sequencer, loop, effects, gain): Start streaming a sequencer.
+         play_chunks(chunks, gain): Start streaming an iterable of stereo chunks.
+         pause(): Hold the transport and output silence.
+         resume(): Continue from where the transport was held.
+         swap(sequencer): Replace the pattern at the next block boundary.
+         set_tempo(step_length): Change the step length at the next block boundary.
+         render(frames): Render the next block of audio.
+         stop(): Stop playback and close the stream.
+     """
+
+    def __init__(self, sample_rate=44100, blocksize=512, stream_factory=None, feed_depth=4):
+        """Initialize the engine without opening a stream."""
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.feed_depth = feed_depth
+        self.stream_factory = stream_factory if stream_factory is not None else sd.OutputStream
+        self.stream = None
+        self.lock = threading.Lock()
+        self.pending_tracks = None
+        self.pending_step_length = None
+        self.tracks = []
+        self.steps = 0
+        self.step_length = 0
+        self.passes = 0
+        self.loop = False
+        self.effects = []
+        self.gain = 1.0
+        self.paused = False
+        self.sequencer = None
+        self.chunks = None
+        self.reset()
+
+    def reset(self):
+        """Rewind the transport and drop every sounding voice."""
+        self.clock = 0
+        self.next_step_time = 0.0
+        self.step_count = 0
+        self.current_step = -1
+        self.voices = []
+        if self.chunks is not None:
+            self.chunks.stop()
+        self.chunks = None
+        self.chunk = None
+        self.chunks_done = False
+
+    def play(self, sequencer, loop=False, effects=(), gain=1.0):
+        """Start streaming a sequencer, restarting the transport."""
+        tracks = self.prepare_tracks(sequencer, gain)
+        with self.lock:
+            self.reset()
+            self.gain = gain
+            self.tracks = tracks
+            self.steps = sequencer.steps
+            self.step_length = sequencer.step_length
+            self.pending_tracks = None
+            self.pending_step_length = None
+            self.loop = loop
+            self.passes = sequencer.repetition
+            self.effects = list(effects)
+            for effect in self.effects:
+                effect.reset()
+        self.follow(sequencer)
+        self.open()
+
+    def play_chunks(self, chunks, gain=1.0):
+        """
+        Start streaming an iterable of (frames, 2) chunks, restarting the transport.
+
+        The chunks are pulled by a ChunkFeeder. The first one is awaited here, so a
+        lazy iterable does its setup before the stream opens rather than in the
+        first callback.
+        """
+        self.follow(None)
+        chunks = ChunkFeeder(chunks, self.feed_depth)
+        first = chunks.get()
+        with self.lock:
+            self.reset()
+            self.gain = gain
+            self.tracks = []
+            self.steps = 0
+            self.pending_tracks = None
+            self.loop = False
+            self.effects = []
+            self.chunks = chunks
+            self.chunk = first
+            self.chunks_done = first is None
+        self.open()
+
+    def open(self):
+        """Open and start the output stream unless it is running already."""
+        if self.stream is None or not self.stream.active:
+            self.close()
+            self.stream = self.stream_factory(samplerate=self.sample_rate, blocksize=self.blocksize,
+                                              channels=2, dtype='float32', callback=self.callback)
+            self.stream.start()
+
+    def pause(self):
+        """Hold the transport and output silence until resume() is called."""
+        self.paused = True
+
+    def resume(self):
+        """Continue from where the transport was held."""
+        self.paused = False
+
+    def swap(self, sequencer):
+        """Replace the pattern at the next block boundary."""
+        tracks = self.prepare_tracks(sequencer)
+        with self.lock:
+            self.pending_tracks = (tracks, sequencer.steps)
+        self.follow(sequencer)
+
+    def follow(self, sequencer):
+        """Listen to the mix bus of the sequencer being played, and stop listening to the previous one."""
+        if sequencer is self.sequencer:
+            return
+        if self.sequencer is not None:
+            self.sequencer.bus.listeners.remove(self.bus_changed)
+        self.sequencer = sequencer
+        if sequencer is not None:
+            sequencer.bus.listeners.append(self.bus_changed)
+
+    def bus_changed(self, bus):
+        """Swap in the new levels of the sequencer being played."""
+        self.swap(self.sequencer)
+
+    def set_tempo(self, step_length):
+        """Change the number of samples per step at the next block boundary."""
+        with self.lock:
+            self.pending_step_length = step_length
+
+    def prepare_tracks(self, sequencer, gain=None):
+        """
+        Convert sequencer tracks to (stereo voice, hit mask) pairs. Float32 voices at unity gain are not copied.
+
+        This runs on the caller's thread, outside the lock, so the audio callback never waits for the copies.
+        """
+        master = self.gain if gain is None else gain
+        tracks = []
+        for (voice, hits), levels in zip(sequencer.tracks, sequencer.bus.matrix):
+            stereo_voice = voice[:, np.newaxis] if voice.ndim == 1 else voice
+            level = levels * master
+            if np.any(level != 1) or stereo_voice.dtype != np.float32:
+                stereo_voice = (stereo_voice * level).astype(np.float32)
+            hit_mask = np.zeros(sequencer.steps, dtype=bool)
+            hit_mask[hits] = True
+            tracks.append((stereo_voice, hit_mask))
+        return tracks
+
+    @property
+    def finished(self):
+        """Whether a non-looping pattern has played all its passes and every voice has ended."""
+        if self.chunks is not None:
+            return self.chunk is None and self.chunks_done
+        return not self.loop and self.step_count >= self.steps * self.passes and not self.voices
+
+    def render_chunks(self, block):
+        """Fill a block from the chunk feeder, keeping the unused end of the last chunk."""
+        filled = 0
+        while filled < len(block):
+            if self.chunk is None:
+                self.chunk = self.chunks.get()
+                if self.chunk is None:
+                    self.chunks_done = True
+                    break
+            count = min(len(block) - filled, len(self.chunk))
+            block[filled:filled + count] = self.chunk[:count] * self.gain
+            filled += count
+            self.chunk = self.chunk[count:] if count < len(self.chunk) else None
+        self.clock += len(block)
+        return block
+
+    def render(self, frames):
+        """
+        Render the next `frames` frames of audio as a (frames, 2) float32 block.
+
+        The whole block is rendered under the lock, so play() and stop() on another
+        thread never change the transport halfway through a callback.
+        """
+        with self.lock:
+            return self.render_block(frames)
+
+    def render_block(self, frames):
+        """Render the next block. The caller must hold the lock."""
+        if self.pending_tracks is not None:
+            self.tracks, self.steps = self.pending_tracks
+            self.pending_tracks = None
+        if self.pending_step_length is not None:
+            self.step_length = self.pending_step_length
+            self.pending_step_length = None
+
+        block = np.zeros((frames, 2), dtype=np.float32)
+        if self.paused:
+            return block
+        if self.chunks is not None:
+            return self.render_chunks(block)
+
+        end = self.clock + frames
+        while self.steps and round(self.next_step_time) < end:
+            if not self.loop and self.step_count >= self.steps * self.passes:
+                break
+            offset = round(self.next_step_time) - self.clock
+            step = self.step_count % self.steps
+            for stereo_voice, hit_mask in self.tracks:
+                if hit_mask[step]:
+                    self.voices.append([stereo_voice, -offset])
+            self.current_step = step
+            self.step_count += 1
+            self.next_step_time += self.step_length
+
+        sounding = []
+        for voice in self.voices:
+            stereo_voice, position = voice
+            begin = max(0, -position)
+            source = max(0, position)
+            count = min(frames - begin, len(stereo_voice) - source)
+            block[begin:begin + count] += stereo_voice[source:source + count]
+            voice[1] = position + frames
+            if voice[1] < len(stereo_voice):
+                sounding.append(voice)
+        self.voices = sounding
+        self.clock = end
+
+        for effect in self.effects:
+            block = effect.process(block).astype(np.float32)
+        return block
+
+    def callback(self, outdata, frames, time, status):
+        """Fill the output buffer of the stream."""
+        outdata[:] = self.render(frames)
+        if self.finished:
+            raise sd.CallbackStop
+
+    def close(self):
+        """Close the output stream if one is open."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def stop(self):
+        """Stop playback and close the stream."""
+        self.follow(None)
+        self.close()
+        with self.lock:
+            self.reset()
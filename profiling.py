@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Span:
+    """
+     A timed stage of a render.
+
+     Attributes:
+         stage (str): Name of the stage.
+         seconds (float): Wall time spent in the stage.
+         nbytes (int): Bytes of the arrays the stage produced.
+         samples (int): Number of samples the stage produced.
+
+     Methods:
+         add(array, samples): Count an array produced by the stage, and its samples if they are not its length.
+     """
+
+    def __init__(self, stage, profile):
+        self.stage = stage
+        self.profile = profile
+        self.seconds = 0.0
+        self.nbytes = 0
+        self.samples = 0
+
+    def add(self, array, samples=None):
+        self.nbytes += array.nbytes
+        self.samples += len(array) if samples is None else samples
+        return array
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self.start
+        self.profile.spans.append(self)
+
+
+class NullSpan:
+    """
+     The span handed out while profiling is off. It records nothing.
+
+     Methods:
+         add(array, samples): Return the array unchanged.
+     """
+
+    def add(self, array, samples=None):
+        return array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+NULL_SPAN = NullSpan()
+_local = threading.local()
+
+
+class RenderProfile:
+    """
+     A collection of the spans recorded while it is active.
+
+     A profile is activated for the current thread with a `with` block, so
+     renders running on other threads are not mixed into it. Profiles can be
+     nested, and the innermost one receives the spans. Work handed to a thread
+     pool is wrapped with carry() to record its spans in the same profile.
+
+     Attributes:
+         spans (list): The recorded spans, in the order they finished.
+
+     Methods:
+         totals(): Return the time, bytes, samples and count of every stage.
+         summary(): Return the totals as a printable table.
+     """
+
+    def __init__(self):
+        self.spans = []
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'profile', None)
+        _local.profile = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.profile = self.previous
+
+    def totals(self):
+        totals = OrderedDict()
+        for span in self.spans:
+            stage = totals.setdefault(span.stage, {'seconds': 0.0, 'nbytes': 0, 'samples': 0, 'count': 0})
+            stage['seconds'] += span.seconds
+            stage['nbytes'] += span.nbytes
+            stage['samples'] += span.samples
+            stage['count'] += 1
+        return totals
+
+    def summary(self):
+        lines = [f"{'stage':<12} {'calls':>6} {'ms':>9} {'KiB':>9} {'samples':>10}"]
+        for stage, total in self.totals().items():
+            lines.append(f"{stage:<12} {total['count']:>6} {total['seconds'] * 1000:>9.2f} "
+                         f"{total['nbytes'] / 1024:>9.1f} {total['samples']:>10}")
+        return '\n'.join(lines)
+
+
+def span(stage):
+    """Return a span timing `stage` in the active profile of this thread, or a no-op span if there is none."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return NULL_SPAN
+    return Span(stage, profile)
+
+
+def carry(function):
+    """Return `function` wrapped to record its spans in the active profile of this thread, from any thread."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return function
+
+    def run(*args, **kwargs):
+        previous = getattr(_local, 'profile', None)
+        _local.profile = profile
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.profile = previous
+    return run
@@ -0,0 +1,173 @@
+import threading
+from collections import deque
+import numpy as np
+from drum_beat import GenerateBeat, Reverb_apply, Sequencer
+
+
+class RenderQueue:
+    """
+     A pool of background threads that keeps random beats rendered ahead of time.
+
+     Every variant (the groove and the sonic storm, each dry or with reverb) has
+     its own queue of fully rendered beats. The workers keep every queue at
+     `depth` beats as long as the beats fit into the memory budget, and refill
+     a queue as soon as a beat is taken from it. A worker draws the pattern
+     first and renders the beat only once its size fits into the budget, so no
+     finished render is ever dropped. Taking a beat therefore costs no
+     rendering. If the queue ran dry, the caller waits for a beat that is being
+     rendered, and renders one itself only if none is.
+
+     Attributes:
+         depth (int): Number of beats kept ready per variant.
+         max_bytes (int): Memory budget of all queued beats.
+         workers (int): Number of render threads.
+         repetition (int): Number of repetitions of each beat.
+         nbytes (int): Memory held by the queued beats.
+
+     Methods:
+         start(): Start the render threads.
+         get(variant): Return a ready beat of a variant as a sequencer.
+         render(variant): Render a beat of a variant in the caller.
+         beat_bytes(sequencer): Return the memory a rendered beat of a sequencer takes.
+         queued(): Return the number of ready beats per variant.
+         stop(): Cancel the render threads and drop the queued beats.
+     """
+
+    variants = {
+        'groove': (0, False),
+        'storm': (1, False),
+        'reverb': (0, True),
+        'reverb_storm': (1, True),
+    }
+    reverb_delay = 100
+    reverb_wet = 0.5
+    reverb_strength = 0.1
+
+    def __init__(self, depth=2, max_bytes=64 * 1024 * 1024, workers=1, repetition=2):
+        """Initialize the queue without starting the render threads."""
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.repetition = repetition
+        self.nbytes = 0
+        self.beats = {variant: deque() for variant in self.variants}
+        self.rendering = {variant: 0 for variant in self.variants}
+        self.reserved = {variant: 0 for variant in self.variants}
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.threads = []
+
+    def start(self):
+        """Start the render threads."""
+        self.stopped = False
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def sequence(self, variant):
+        """Draw the pattern of a beat of a variant and return its sequencer."""
+        beat, _ = self.variants[variant]
+        return GenerateBeat(repetition=self.repetition).generate_sequencers()[beat]
+
+    def render_sequencer(self, variant, sequencer):
+        """Render a sequencer of a variant into a single stereo buffer."""
+        _, reverb = self.variants[variant]
+        audio = sequencer.render()
+        if reverb:
+            audio = Reverb_apply.apply_reverb(audio, self.reverb_delay, self.reverb_wet, self.reverb_strength)
+        return audio
+
+    def render(self, variant):
+        """Render a beat of a variant and return it as a single stereo buffer."""
+        return self.render_sequencer(variant, self.sequence(variant))
+
+    @staticmethod
+    def beat_bytes(sequencer):
+        """Return the memory the rendered stereo beat of a sequencer takes, with or without reverb."""
+        itemsize = np.result_type(sequencer.dtype, np.float32).itemsize
+        return sequencer.cycle * sequencer.repetition * 2 * itemsize
+
+    def get(self, variant):
+        """Return a ready beat of a variant as a sequencer, rendering one if none is queued or being rendered."""
+        with self.condition:
+            queue = self.beats[variant]
+            while not queue and self.reserved[variant] and not self.stopped:
+                self.condition.wait()
+            audio = queue.popleft() if queue else None
+            if audio is not None:
+                self.nbytes -= audio.nbytes
+                self.condition.notify_all()
+        if audio is None:
+            audio = self.render(variant)
+        return self.as_sequencer(audio)
+
+    @staticmethod
+    def as_sequencer(audio):
+        """Wrap a rendered stereo beat into a sequencer that plays it once."""
+        sequencer = Sequencer(len(audio), 1, dtype=audio.dtype)
+        sequencer.add_track(audio, [0])
+        return sequencer
+
+    def queued(self):
+        """Return the number of ready beats per variant."""
+        with self.condition:
+            return {variant: len(queue) for variant, queue in self.beats.items()}
+
+    def next_variant(self):
+        """Return the variant with the fewest ready beats, or None if every queue is full or the budget is used."""
+        if self.nbytes >= self.max_bytes:
+            return None
+        pending = {variant: len(queue) + self.rendering[variant] for variant, queue in self.beats.items()}
+        variant = min(pending, key=pending.get)
+        return variant if pending[variant] < self.depth else None
+
+    def work(self):
+        """Render beats until the queue is stopped."""
+        while True:
+            with self.condition:
+                while not self.stopped and self.next_variant() is None:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                variant = self.next_variant()
+                self.rendering[variant] += 1
+
+            sequencer = self.sequence(variant)
+            nbytes = self.beat_bytes(sequencer)
+
+            with self.condition:
+                # Reserve the memory before rendering, waiting until a beat is taken if it does not fit.
+                while not self.stopped and self.nbytes + nbytes > self.max_bytes:
+                    self.condition.wait()
+                if self.stopped:
+                    self.rendering[variant] -= 1
+                    return
+                self.nbytes += nbytes
+                self.reserved[variant] += 1
+
+            audio = self.render_sequencer(variant, sequencer)
+
+            with self.condition:
+                self.rendering[variant] -= 1
+                self.reserved[variant] -= 1
+                if self.stopped:
+                    return
+                self.beats[variant].append(audio)
+                self.nbytes += audio.nbytes - nbytes
+                self.condition.notify_all()
+
+    def stop(self):
+        """Cancel the render threads and drop the queued beats."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        with self.condition:
+            for queue in self.beats.values():
+                queue.clear()
+            self.rendering = {variant: 0 for variant in self.variants}
+            self.reserved = {variant: 0 for variant in self.variants}
+            self.nbytes = 0
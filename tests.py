@@ -1,6 +1,23 @@
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
 import numpy as np
-from drum_beat import Kick, Snare, HiHat, OpenHat, WoodBlock, MidTom, Clap, Tambourine, Bongo, Tabla, GenerateBeat
+from scipy.signal import fftconvolve, sosfilt
+from scipy.io import wavfile
+from playback import StreamEngine, NullStream
+from batch_render import BatchRenderer
+from benchmark import BenchmarkSuite, peak_memory, reference_apply_reverb
+from export import FlacWriter, crc8, crc16, quantize, write_chunks
+from profiling import RenderProfile, NULL_SPAN, span
+from render_queue import RenderQueue
+from drum_game import BeatMaker, kit_rows, sound_names
+from drum_beat import Kick, Snare, HiHat, OpenHat, WoodBlock, MidTom, Clap, Tambourine, Bongo, Tabla, GenerateBeat, \
+    BeatMemo, Reverb_apply, FeedbackDelay, ConvolutionReverb, VoiceBank, MixBus, Panning, FilterRegistry, \
+    Sequencer, Pattern, SoundFile, SampleLibrary, to_int16
 
 
 class TestGenerateBeat(unittest.TestCase):
@@ -15,6 +32,25 @@ class TestGenerateBeat(unittest.TestCase):
         self.assertGreater(np.count_nonzero(beat1), min_non_zero_samples)
         self.assertGreater(np.count_nonzero(beat2), min_non_zero_samples)
 
+    def test_seeded_render_is_deterministic(self):
+        random_state, numpy_state = random.getstate(), np.random.get_state()
+        first = GenerateBeat(repetition=2, seed=3, voice_bank=VoiceBank()).generate_sound()
+        second = GenerateBeat(repetition=2, seed=3, voice_bank=VoiceBank()).generate_sound()
+        for beat, again in zip(first, second):
+            np.testing.assert_array_equal(beat, again)
+        self.assertEqual(random.getstate(), random_state)
+        np.testing.assert_array_equal(np.random.get_state()[1], numpy_state[1])
+
+        other = GenerateBeat(repetition=2, seed=4).generate_sound()
+        self.assertFalse(all(np.array_equal(beat, again) for beat, again in zip(first, other)))
+
+    def test_pipeline_dtype(self):
+        for dtype in (np.float32, np.float64):
+            beat1, beat2 = GenerateBeat(repetition=2, dtype=dtype).generate_sound()
+            self.assertEqual((beat1.dtype, beat2.dtype), (dtype, dtype))
+            # Both beats are built from float voices, so their levels are comparable.
+            self.assertLess(np.max(np.abs(beat2)), 20)
+
     def test_sound_generation(self):
         duration = 150
         sample_rate = 44100
@@ -69,6 +105,735 @@ class TestGenerateBeat(unittest.TestCase):
         self.assertIsInstance(tabla_sound, np.ndarray)
         self.assertEqual(tabla_sound.shape, (duration * sample_rate // 1000,))
 
+    def test_batch_matches_single_hits(self):
+        frequencies = np.linspace(100, 300, 8)
+        velocities = np.linspace(0.25, 1.0, 8)
+        batch = Snare(44100, np.random.default_rng(2)).generate_snare_sound(frequencies, 150, velocities)
+        snare = Snare(44100, np.random.default_rng(2))
+        self.assertEqual(batch.shape, (8, 6615))
+        for hit, frequency, velocity in zip(batch, frequencies, velocities):
+            np.testing.assert_array_equal(hit, snare.generate_snare_sound(frequency, 150, velocity))
+
+        kicks = Kick().generate_kick_sound([[30, 40], [50, 60]], 150)
+        self.assertEqual(kicks.shape, (2, 2, 6615))
+        np.testing.assert_array_equal(kicks[1, 0], Kick().generate_kick_sound(50, 150))
+
+    def test_batch_of_durations_is_padded_with_silence(self):
+        durations = np.array([50, 150, 100])
+        batch = Tabla(44100, np.random.default_rng(0)).generate_drum_sound(220, durations)
+        self.assertEqual(batch.shape, (3, 6615))
+        for hit, duration in zip(batch, durations):
+            length = duration * 44100 // 1000
+            self.assertEqual(np.max(np.abs(hit[:length])), 1.0)
+            self.assertFalse(np.any(hit[length:]))
+
+        # Envelopes like time ** 0.1 must not see the padding of the shorter hits run past the end of the grid.
+        with np.errstate(all='raise'):
+            batch = OpenHat(44100, np.random.default_rng(0)).generate_open_hat(np.array([50, 150]))
+        self.assertTrue(np.all(np.isfinite(batch)))
+        self.assertFalse(np.any(batch[0, 50 * 44100 // 1000:]))
+
+    def test_fractional_durations_keep_their_sample_counts(self):
+        # 44100 * d / 1000 and 44.1 * d round to different sides of 3000 for this duration.
+        duration = 68.02721088435374
+        self.assertEqual(len(Kick().generate_kick_sound(40, duration)), int(44100 * duration / 1000))
+        self.assertEqual(len(Snare().generate_snare_sound(250, duration)), int(44100 / 1000 * duration))
+        batch = Kick().generate_kick_sound(40, np.array([duration, 100]))
+        np.testing.assert_array_equal(batch[0, :2999], Kick().generate_kick_sound(40, duration))
+        self.assertFalse(np.any(batch[0, 2999:]))
+
+
+class TestReverb(unittest.TestCase):
+    def test_matches_ring_buffer(self):
+        signal = np.random.uniform(-1, 1, (3000, 2))
+        expected = reference_apply_reverb(signal, 100, 0.5, 0.1)
+
+        stereo = Reverb_apply.apply_reverb(signal, 100, 0.5, 0.1, block_size=257)
+        np.testing.assert_allclose(stereo, expected)
+
+        mono = Reverb_apply.apply_reverb(signal[:, 0], 100, 0.5, 0.1)
+        np.testing.assert_allclose(mono, expected[:, 0])
+
+    def test_keeps_float32(self):
+        signal = np.random.uniform(-1, 1, (3000, 2))
+        single = Reverb_apply.apply_reverb(signal.astype(np.float32), 100, 0.5, 0.1)
+        self.assertEqual(single.dtype, np.float32)
+        np.testing.assert_allclose(single, Reverb_apply.apply_reverb(signal, 100, 0.5, 0.1), atol=1e-5)
+
+    def test_block_size_smaller_than_delay(self):
+        signal = np.random.uniform(-1, 1, 1000)
+        delay_line = FeedbackDelay(100, 0.5, 0.3)
+        blocks = [delay_line.process(signal[i:i + 37]) for i in range(0, len(signal), 37)]
+        np.testing.assert_allclose(np.concatenate(blocks), reference_apply_reverb(signal, 100, 0.5, 0.3))
+
+    def test_convolution_matches_direct_convolution(self):
+        rng = np.random.default_rng(0)
+        signal = rng.uniform(-1, 1, (3000, 2))
+        for impulse_response in (rng.normal(size=(700, 2)), rng.normal(size=700), rng.normal(size=20)):
+            reverb = ConvolutionReverb(impulse_response, wet=1.0, partition=64, normalize=False)
+            blocks = [reverb.process(signal[start:start + size]) for start, size in
+                      ((0, 1), (1, 63), (64, 100), (164, 2836))]
+            kernel = impulse_response if impulse_response.ndim == 2 else impulse_response[:, np.newaxis]
+            expected = fftconvolve(signal, kernel, axes=0)[:len(signal)]
+            np.testing.assert_allclose(np.concatenate(blocks), expected, atol=1e-9)
+
+    def test_convolution_impulse_responses(self):
+        reverb = ConvolutionReverb.synthetic(decay=0.5, seed=1, wet=0.4)
+        tail = np.abs(reverb.impulse_response)
+        self.assertEqual(tail.shape, (22050, 2))
+        self.assertGreater(np.max(tail[:2205]), 100 * np.max(tail[-2205:]))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'room.wav')
+            wavfile.write(path, 44100, to_int16(reverb.impulse_response / np.max(tail)))
+            loaded = ConvolutionReverb.from_wav(path, wet=0.4)
+            np.testing.assert_allclose(loaded.impulse_response, reverb.impulse_response, atol=1e-3)
+            with self.assertRaises(ValueError):
+                ConvolutionReverb.from_wav(path, sample_rate=48000)
+
+        beat = GenerateBeat(repetition=2, seed=6).generate_sound()[0]
+        chunks = GenerateBeat(repetition=2, seed=6).generate_chunks(1, 1000, [loaded])
+        expected = ConvolutionReverb(loaded.impulse_response, wet=0.4).process(beat)
+        self.assertEqual(expected.dtype, np.float32)
+        np.testing.assert_allclose(np.concatenate(list(chunks)), expected, atol=1e-5)
+
+
+class TestVoiceBank(unittest.TestCase):
+    def test_reuses_read_only_voices(self):
+        bank = VoiceBank()
+        kick = bank.get('kick', (30,), 150)
+        self.assertIs(bank.get('kick', (30,), 150), kick)
+        self.assertFalse(kick.flags.writeable)
+        self.assertEqual((bank.hits, bank.misses), (1, 1))
+
+        generate_beat = GenerateBeat(repetition=1, voice_bank=bank)
+        generate_beat.generate_sound()
+        generate_beat.generate_sound()
+        self.assertEqual(bank.misses, 9)
+
+    def test_seeded_voices_and_eviction(self):
+        bank = VoiceBank(max_bytes=2 * 6615 * np.dtype(np.float32).itemsize)
+        first = bank.get('snare', (250,), 150, seed=1)
+        bank.get('snare', (250,), 150, seed=2)
+        bank.get('snare', (250,), 150, seed=3)
+        self.assertLessEqual(bank.nbytes, bank.max_bytes)
+        self.assertEqual(len(bank.voices), 2)
+
+        again = bank.get('snare', (250,), 150, seed=1)
+        self.assertIsNot(again, first)
+        np.testing.assert_array_equal(again, first)
+
+    def test_instruments_have_independent_streams(self):
+        self.assertFalse(np.array_equal(VoiceBank.generator('snare', 1).random(8),
+                                        VoiceBank.generator('hi_hat', 1).random(8)))
+        alone = VoiceBank().get('snare', (250,), 150, seed=1)
+        bank = VoiceBank()
+        bank.get('hi_hat', (), 150, seed=1)
+        np.testing.assert_array_equal(bank.get('snare', (250,), 150, seed=1), alone)
+
+    def test_voices_in_requested_dtype(self):
+        bank = VoiceBank()
+        for instrument, params in [('kick', (30,)), ('clap', ()), ('tabla', (150,))]:
+            single = bank.get(instrument, params, 150, seed=0)
+            double = bank.get(instrument, params, 150, seed=0, dtype=np.float64)
+            self.assertEqual((single.dtype, double.dtype), (np.float32, np.float64))
+            np.testing.assert_allclose(single, double, rtol=1e-6, atol=1e-6)
+
+
+class TestBeatMemo(unittest.TestCase):
+    def test_repeated_seed_is_a_hit(self):
+        memo = BeatMemo()
+        beats = memo.get(11, repetition=1)
+        self.assertIs(memo.get(11, repetition=1), beats)
+        self.assertEqual((memo.hits, memo.misses), (1, 1))
+        self.assertFalse(beats[0].flags.writeable)
+
+        memo.get(11, repetition=2)
+        self.assertEqual(memo.misses, 2)
+        np.testing.assert_array_equal(memo.get(11, repetition=1)[1],
+                                      GenerateBeat(repetition=1, seed=11).generate_sound()[1])
+
+
+class TestFilterRegistry(unittest.TestCase):
+    def test_designs_are_shared(self):
+        registry = FilterRegistry()
+        sos = registry.design(10, 100, 'hp', fs=1000)
+        self.assertIs(registry.design(10, 100, 'highpass', fs=1000), sos)
+        self.assertIsNot(registry.design(10, 100, 'hp', fs=44100), sos)
+        np.testing.assert_array_equal(HiHat().create_filter()[0], sos)
+
+    def test_chunked_filtering_is_continuous(self):
+        signal = np.random.uniform(-1, 1, (2, 5000))
+        registry = FilterRegistry()
+        expected = sosfilt(registry.design(4, [1000, 8000], 'band', fs=44100), signal)
+
+        band_pass = registry.create(4, [1000, 8000], 'band', fs=44100)
+        chunks = [band_pass.process(signal[:, i:i + 700]) for i in range(0, signal.shape[1], 700)]
+        np.testing.assert_allclose(np.concatenate(chunks, axis=1), expected)
+
+
+class TestSequencer(unittest.TestCase):
+    def test_matches_concatenated_sequences(self):
+        generate_beat = GenerateBeat(repetition=3)
+        voices = [Kick().generate_kick_sound(30, 150), Clap().generate_clap_sound(150)]
+        patterns = ['^_^^_', '_^__^']
+
+        sequences = [np.concatenate([voice if char == '^' else generate_beat.pause(voice) for char in pattern])
+                     for voice, pattern in zip(voices, patterns)]
+        expected = generate_beat.panning_mixture(sequences)
+
+        hits = Pattern.from_strings(patterns).hits
+        beats = generate_beat.mix_tracks(list(zip(voices, hits)), len(voices[0]), 5)
+        self.assertEqual(beats.shape, expected.shape)
+        np.testing.assert_allclose(beats, expected, atol=1e-9)
+
+    def test_long_voices_overlap_and_are_cut_at_the_end(self):
+        sequencer = Sequencer(step_length=4, steps=3, repetition=2)
+        sequencer.add_track(np.ones(6), [0, 2], gain=(1, 0.5))
+        beats = sequencer.render()
+        np.testing.assert_array_equal(beats[:, 0], [1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 1, 1] * 2)
+        np.testing.assert_array_equal(beats[:, 1], beats[:, 0] / 2)
+
+    def test_chunks_are_slices_of_the_render(self):
+        sequencer = Sequencer(step_length=100.5, steps=7, repetition=5)
+        sequencer.add_track(np.hanning(500), [0, 1, 2, 5], gain=(0.3, 0.7))
+        chunks = list(sequencer.iter_chunks(chunk_size=333))
+        self.assertTrue(all(len(chunk) == 333 for chunk in chunks[:-1]))
+        np.testing.assert_array_equal(np.concatenate(chunks), sequencer.render())
+
+    def test_chunked_render_has_bounded_memory(self):
+        generate_beat = GenerateBeat(repetition=400, seed=2)
+        # Warm the voice bank so only the render is traced. A beat has at least 5 steps of float32 stereo.
+        beat_bytes = 400 * 5 * len(generate_beat.voices()[0]) * 2 * 4
+        peak = peak_memory(lambda: sum(len(chunk) for chunk in generate_beat.generate_chunks(
+            effects=[FeedbackDelay(100, 0.5, 0.1)])))
+        self.assertLess(peak, beat_bytes / 20)
+
+    def test_threaded_render_is_identical(self):
+        sequencer = Sequencer(step_length=100.5, steps=7, repetition=9)
+        sequencer.add_track(np.hanning(500), [0, 1, 2, 5], gain=(0.3, 0.7))
+        sequencer.add_track(np.random.uniform(-1, 1, 300), [1, 2, 3])
+        np.testing.assert_array_equal(sequencer.render(workers=3), sequencer.render())
+
+        serial = GenerateBeat(repetition=4, seed=9, voice_bank=VoiceBank()).generate_sound()
+        threaded = GenerateBeat(repetition=4, seed=9, voice_bank=VoiceBank(), workers=4).generate_sound()
+        for beat, again in zip(serial, threaded):
+            np.testing.assert_array_equal(beat, again)
+
+    def test_generated_chunks_with_reverb_match_the_full_render(self):
+        beat = GenerateBeat(repetition=3, seed=5).generate_sound()[1]
+        expected = Reverb_apply.apply_reverb(beat, 100, 0.5, 0.1)
+        chunks = GenerateBeat(repetition=3, seed=5).generate_chunks(2, 1000, [FeedbackDelay(100, 0.5, 0.1)])
+        actual = np.concatenate(list(chunks))
+        np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'beat.wav')
+            self.assertEqual(write_chunks(path, [actual[:777], actual[777:]]), len(actual))
+            rate, written = wavfile.read(path)
+            self.assertEqual(rate, 44100)
+            np.testing.assert_array_equal(written, to_int16(actual))
+
+
+class TestExport(unittest.TestCase):
+    def decode_flac(self, data):
+        """A minimal FLAC decoder for the subframes FlacWriter writes, checking every CRC on the way."""
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).tobytes()
+        position = 0
+
+        def read(width, signed=False):
+            nonlocal position
+            value = 0
+            for bit in bits[position:position + width]:
+                value = value << 1 | bit
+            position += width
+            return value - (1 << width) if signed and width and value >> (width - 1) else value
+
+        def unary():
+            nonlocal position
+            stop = bits.index(1, position)
+            count, position = stop - position, stop + 1
+            return count
+
+        self.assertEqual(read(32), int.from_bytes(b'fLaC', 'big'))
+        self.assertEqual((read(8), read(24)), (0x80, 34))
+        # Skip the block and frame sizes, sample rate, channels and bits per sample of the stream info.
+        position += 108
+        total = read(36)
+        position += 128
+        block_sizes = {code: size for size, code in FlacWriter.block_size_codes.items()}
+        coefficients = [[], [1], [2, -1], [3, -3, 1], [4, -6, 4, -1]]
+        frames, kinds = [], set()
+        while position < len(bits):
+            start = position // 8
+            self.assertEqual(read(16), 0xFFF8)
+            block_size_code, _, assignment, sample_size_code, _ = read(4), read(4), read(4), read(3), read(1)
+            sample_bits = {code: size for size, code in FlacWriter.sample_size_codes.items()}[sample_size_code]
+            # The frame number is UTF-8 coded, the leading ones of the first byte count its bytes.
+            first, leading = read(8), 0
+            while first << leading & 0x80:
+                leading += 1
+            read(8 * max(leading - 1, 0))
+            length = read(16) + 1 if block_size_code == 7 else block_sizes[block_size_code]
+            self.assertEqual(read(8), crc8(data[start:position // 8 - 1]))
+
+            names = FlacWriter.stereo_assignments.get(assignment, ('left', 'right'))
+            channels = {}
+            for name in names:
+                width = sample_bits + (name == 'side')
+                read(1)
+                kind = read(6)
+                read(1)
+                if kind == 0:
+                    kinds.add('constant')
+                    signal = [read(width, True)] * length
+                elif kind == 1:
+                    kinds.add('verbatim')
+                    signal = [read(width, True) for _ in range(length)]
+                else:
+                    kinds.add('fixed')
+                    order = kind - 8
+                    signal = [read(width, True) for _ in range(order)]
+                    method, _ = read(2), read(4)
+                    parameter = read(4 + method)
+                    for _ in range(length - order):
+                        folded = unary() << parameter | read(parameter)
+                        residual = (folded >> 1) ^ -(folded & 1)
+                        signal.append(residual + sum(c * signal[-1 - i] for i, c in enumerate(coefficients[order])))
+                channels[name] = np.array(signal, dtype=np.int64)
+
+            position = -(-position // 8) * 8
+            self.assertEqual(read(16), crc16(data[start:position // 8 - 2]))
+            if 'mid' in channels:
+                mid, side = channels['mid'] << 1 | channels['side'] & 1, channels['side']
+                channels = {'left': (mid + side) >> 1, 'right': (mid - side) >> 1}
+            elif 'side' in channels:
+                if 'left' in channels:
+                    channels['right'] = channels['left'] - channels['side']
+                else:
+                    channels['left'] = channels['right'] + channels['side']
+            frames.append(np.stack([channels['left'], channels['right']], axis=1))
+        samples = np.concatenate(frames)
+        self.assertEqual(len(samples), total)
+        return samples, kinds
+
+    def test_flac_round_trip(self):
+        beat = GenerateBeat(repetition=1, seed=4).generate_sound()[0][:3072]
+        noise = np.random.default_rng(0).uniform(-1, 1, (1000, 2))
+        signal = np.concatenate((beat, np.zeros((1024, 2)), noise, beat[:700] * [1, -0.5]))
+        for bits in (16, 24):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'beat.flac')
+                with FlacWriter(path, bits=bits, block_size=1024) as writer:
+                    writer.write(signal[:2500])
+                    writer.write(signal[2500:])
+                with open(path, 'rb') as file:
+                    samples, kinds = self.decode_flac(file.read())
+            # The last frame is shorter than the block size.
+            self.assertNotEqual(len(signal) % 1024, 0)
+            np.testing.assert_array_equal(samples, quantize(signal, bits))
+            self.assertEqual(kinds, {'constant', 'verbatim', 'fixed'})
+
+    def test_dither_is_seeded_and_within_one_step(self):
+        signal = np.linspace(-1.0, 1.0, 10000)
+        dithered = quantize(signal, 24, dither=True, rng=np.random.default_rng(3))
+        np.testing.assert_array_equal(dithered, quantize(signal, 24, dither=True, rng=np.random.default_rng(3)))
+        self.assertLessEqual(np.max(np.abs(dithered - signal * 8388607)), 2)
+        np.testing.assert_array_equal(quantize(signal), to_int16(signal))
+
+    def test_checksums(self):
+        self.assertEqual(crc8(b'123456789'), 0xF4)
+        self.assertEqual(crc16(b'123456789'), 0xFEE8)
+        data = bytes(range(256)) * 3
+        expected = 0
+        for byte in data:
+            expected ^= byte << 8
+            for _ in range(8):
+                expected = ((expected << 1) ^ 0x8005 if expected & 0x8000 else expected << 1) & 0xFFFF
+        self.assertEqual(crc16(data), expected)
+
+    def test_flac_stream_info(self):
+        signal = GenerateBeat(repetition=1, seed=4).generate_sound()[0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'beat.flac')
+            self.assertEqual(write_chunks(path, [signal[:5000], signal[5000:]], bits=24), len(signal))
+            with open(path, 'rb') as file:
+                data = file.read()
+
+        self.assertEqual(data[:4], b'fLaC')
+        info = int.from_bytes(data[8:42], 'big')
+        self.assertEqual(info >> (272 - 16), 4096)
+        self.assertEqual((info >> 128) & (2 ** 36 - 1), len(signal))
+        self.assertEqual(((info >> 164) & 31) + 1, 24)
+        pcm = quantize(signal, 24).astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        self.assertEqual(data[26:42], hashlib.md5(pcm).digest())
+        self.assertLess(len(data), len(pcm))
+        # The first frame starts right after the stream info and ends with its CRC-16.
+        self.assertEqual(data[42:44], b'\xff\xf8')
+
+
+class TestMixBus(unittest.TestCase):
+    def test_mixes_with_gain_pan_mute_and_solo(self):
+        stems = np.random.uniform(-1, 1, (3, 1000)).astype(np.float32)
+        bus = MixBus()
+        self.assertEqual([bus.add_strip(0.5), bus.add_strip(1.0, 0.3), bus.add_strip((0.2, 0.9))], [0, 1, 2])
+        levels = [(0.5, 0.5), Panning().gains(0.3), (0.2, 0.9)]
+        expected = sum(stem[:, np.newaxis] * np.array(level, dtype=np.float32) for stem, level in zip(stems, levels))
+        np.testing.assert_allclose(bus.mix(stems), expected, atol=1e-6)
+
+        bus.mute(0)
+        np.testing.assert_allclose(bus.mix(stems), expected - stems[0][:, np.newaxis] * 0.5, atol=1e-6)
+        bus.solo(2)
+        np.testing.assert_allclose(bus.mix(stems), stems[2][:, np.newaxis] * np.float32([0.2, 0.9]), atol=1e-6)
+        bus.solo(2, False)
+        bus.set_strip(1, 0.0)
+        np.testing.assert_allclose(bus.mix(stems), stems[2][:, np.newaxis] * np.float32([0.2, 0.9]), atol=1e-6)
+        with self.assertRaises(ValueError):
+            bus.mix(stems[:2])
+
+    def test_sequencer_strips(self):
+        sequencer = Sequencer(step_length=4, steps=3)
+        sequencer.add_track(np.ones(2), [0])
+        sequencer.add_track(np.ones(2), [1], gain=(0.5, 0.25))
+        sequencer.bus.mute(0)
+        np.testing.assert_array_equal(sequencer.render()[:, 1], [0, 0, 0, 0, 0.25, 0.25, 0, 0, 0, 0, 0, 0])
+
+        engine = StreamEngine(blocksize=4, stream_factory=NullStream)
+        engine.play(sequencer, loop=True)
+        np.testing.assert_array_equal(engine.stream.pull(3), sequencer.render())
+        # Mute and solo reach the playing engine at the next block.
+        sequencer.bus.mute(0, False)
+        sequencer.bus.solo(0)
+        np.testing.assert_array_equal(engine.stream.pull(3)[:, 1], [1, 1, 0, 0] + [0] * 8)
+        engine.stop()
+        self.assertEqual(sequencer.bus.listeners, [])
+
+
+class TestPattern(unittest.TestCase):
+    def test_strings_and_bits_round_trip(self):
+        pattern = Pattern.from_strings(['^_^^_', '_^__^'])
+        self.assertEqual((pattern.instruments, pattern.steps), (2, 5))
+        self.assertEqual(pattern.to_strings(), ['^_^^_', '_^__^'])
+
+        packed = pattern.pack()
+        self.assertEqual(packed.shape, (2, 1))
+        np.testing.assert_array_equal(Pattern.unpack(packed, 5).hits, pattern.hits)
+
+        pattern.toggle(1, 0)
+        pattern.toggle(0, 0)
+        self.assertEqual(pattern.to_strings(), ['__^^_', '^^__^'])
+        pattern.clear()
+        self.assertFalse(pattern.hits.any())
+
+    def test_random_batch_density(self):
+        rng = np.random.default_rng(0)
+        batch = Pattern.random_batch(2000, 3, 16, density=np.array([[0.1], [0.5], [0.9]]), rng=rng)
+        self.assertEqual(batch.shape, (2000, 3, 16))
+        np.testing.assert_allclose(batch.mean(axis=(0, 2)), [0.1, 0.5, 0.9], atol=0.01)
+
+    def test_sequencer_from_pattern(self):
+        pattern = Pattern.from_strings(['^_^', '_^_'])
+        sequencer = Sequencer.from_pattern(pattern, [np.ones(2), np.ones(2)], [(1, 0), (0, 1)], step_length=2)
+        np.testing.assert_array_equal(sequencer.render(), [[1, 0], [1, 0], [0, 1], [0, 1], [1, 0], [1, 0]])
+
+
+class TestStreamEngine(unittest.TestCase):
+    def make_sequencer(self, hits, steps=4, repetition=2):
+        sequencer = Sequencer(step_length=300, steps=steps, repetition=repetition)
+        sequencer.add_track(np.hanning(300), hits, gain=(0.5, 1.0))
+        return sequencer
+
+    def start(self, sequencer, **kwargs):
+        engine = StreamEngine(blocksize=128, stream_factory=NullStream)
+        engine.play(sequencer, **kwargs)
+        return engine
+
+    def test_streams_the_rendered_beat(self):
+        sequencer = self.make_sequencer([0, 1, 3])
+        engine = self.start(sequencer)
+        streamed = engine.stream.pull(20)
+        self.assertFalse(engine.stream.active)
+
+        expected = sequencer.render()
+        np.testing.assert_allclose(streamed[:len(expected)], expected, atol=1e-6)
+        self.assertFalse(np.any(streamed[len(expected):]))
+
+    def test_streams_chunks(self):
+        sequencer = self.make_sequencer([0, 1, 3])
+        engine = StreamEngine(blocksize=128, stream_factory=NullStream)
+        engine.play_chunks(sequencer.iter_chunks(chunk_size=50), gain=0.5)
+        streamed = engine.stream.pull(30)
+        self.assertFalse(engine.stream.active)
+
+        expected = sequencer.render() * 0.5
+        self.assertEqual(len(streamed), -(-len(expected) // 128) * 128)
+        np.testing.assert_allclose(streamed[:len(expected)], expected, atol=1e-6)
+        self.assertFalse(np.any(streamed[len(expected):]))
+
+        # A lazy iterable is primed before the stream opens, and pulled on a feeder thread, not in the callback.
+        engine = StreamEngine(blocksize=128, stream_factory=NullStream)
+        pulled = []
+
+        def lazy_chunks():
+            pulled.append(engine.stream)
+            for chunk in sequencer.iter_chunks(chunk_size=50):
+                pulled.append(threading.current_thread())
+                yield chunk
+        engine.play_chunks(lazy_chunks())
+        self.assertIsNone(pulled[0])
+        np.testing.assert_allclose(engine.stream.pull(30)[:len(expected)], expected * 2, atol=1e-6)
+        self.assertNotIn(threading.current_thread(), pulled)
+        engine.play_chunks([])
+        self.assertEqual(len(engine.stream.pull(4)), 128)
+
+    def test_loops_and_swaps_patterns_at_block_boundaries(self):
+        engine = self.start(self.make_sequencer([0]), loop=True)
+        first = engine.stream.pull(30)
+        self.assertTrue(engine.stream.active)
+        self.assertEqual(len(first), 3840)
+        np.testing.assert_allclose(first[1200:1500], first[:300])
+
+        engine.swap(self.make_sequencer([2]))
+        swapped = engine.stream.pull(10)
+        self.assertEqual(engine.current_step, 1)
+        np.testing.assert_allclose(swapped[360:660], first[:300])
+        self.assertFalse(np.any(swapped[660:]))
+
+    def test_tempo_changes_move_the_following_steps(self):
+        engine = self.start(self.make_sequencer([0, 1, 2, 3], steps=4, repetition=1))
+        streamed = [engine.stream.pull(1)]
+        engine.set_tempo(400.4)
+        streamed = np.concatenate(streamed + [engine.stream.pull(20)])
+        onsets = np.flatnonzero(np.diff((streamed[:, 1] > 0).astype(int)) == 1) + 1
+        np.testing.assert_array_equal(onsets, [1, 301, 701, 1102])
+
+    def test_pause_holds_the_transport(self):
+        engine = self.start(self.make_sequencer([0, 1, 2, 3]), loop=True)
+        engine.stream.pull(3)
+        engine.pause()
+        self.assertFalse(np.any(engine.stream.pull(5)))
+        self.assertEqual(engine.current_step, 1)
+        engine.resume()
+        engine.stream.pull(2)
+        self.assertEqual(engine.current_step, 2)
+
+
+class TestBatchRenderer(unittest.TestCase):
+    def test_parallel_output_matches_serial(self):
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            BatchRenderer(serial_dir, repetition=1, seed=7).run(4, workers=1)
+            BatchRenderer(parallel_dir, repetition=1, seed=7).run(4, workers=2)
+
+            self.assertEqual(sorted(os.listdir(serial_dir)), sorted(os.listdir(parallel_dir)))
+            for name in os.listdir(serial_dir):
+                serial_rate, serial = wavfile.read(os.path.join(serial_dir, name))
+                parallel_rate, parallel = wavfile.read(os.path.join(parallel_dir, name))
+                self.assertEqual(serial.dtype, np.int16)
+                self.assertEqual(serial.shape[1], 2)
+                np.testing.assert_array_equal(serial, parallel)
+
+
+class TestSoundFile(unittest.TestCase):
+    def test_regenerates_only_stale_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sound_file = SoundFile(directory=directory)
+            self.assertEqual(len(sound_file.generate_sound_files(workers=2)), 6)
+            self.assertEqual(sound_file.generate_sound_files(), [])
+            rate, kick = wavfile.read(os.path.join(directory, 'kick_sound.wav'))
+            self.assertEqual((rate, kick.dtype, kick.shape), (44100, np.int16, (6615,)))
+
+            os.remove(os.path.join(directory, 'snare_sound.wav'))
+            self.assertEqual(sound_file.generate_sound_files(), ['snare_sound.wav'])
+
+            sound_file.sounds = [('kick_sound.wav', 'kick', (40,))] + SoundFile.sounds[1:]
+            self.assertEqual(sound_file.generate_sound_files(), ['kick_sound.wav'])
+            self.assertEqual(SoundFile(directory=directory, seed=1).stale_sounds()[0][0], 'kick_sound.wav')
+            self.assertFalse([name for name in os.listdir(directory) if name.endswith('.tmp')])
+
+            umask = os.umask(0)
+            os.umask(umask)
+            self.assertEqual(os.stat(os.path.join(directory, 'kick_sound.wav')).st_mode & 0o777, 0o666 & ~umask)
+            sound_file.cache_version += 1
+            self.assertEqual(len(sound_file.stale_sounds()), 6)
+
+    def test_sample_library_maps_samples_on_first_use(self):
+        with tempfile.TemporaryDirectory() as directory:
+            SoundFile(directory=directory).generate_sound_files(workers=1)
+            library = SampleLibrary.from_directory(directory, ['kick_sound.wav', 'snare_sound.wav', 'kick_sound.wav'])
+            self.assertEqual((len(library), library.loaded()), (3, 0))
+
+            pattern = Pattern.from_strings(['^_', '__', '_^'])
+            sequencer = Sequencer.from_pattern(pattern, library, [(1, 1)] * 3, step_length=6615)
+            self.assertEqual(library.loaded(), 1)
+            self.assertIsInstance(library[0], np.memmap)
+            self.assertIs(library[2], library[0])
+            self.assertEqual(sequencer.render().shape, (2 * 6615, 2))
+            del sequencer, library
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_runs_and_flags_regressions(self):
+        suite = BenchmarkSuite(repeat=1, durations=(50,), sample_rates=(22050,), steps=(4,), repetitions=(1,))
+        cases = list(suite.synthesis_cases()) + list(suite.sequencing_cases())
+        self.assertEqual(len(cases), 8)
+        for case in cases:
+            self.assertGreater(case['real_time_factor'], 0)
+            self.assertGreater(case['peak_bytes'], 0)
+
+        baseline = {'cases': [dict(case, seconds=case['seconds'] / 2) for case in cases]}
+        self.assertEqual(len(BenchmarkSuite.compare({'cases': cases}, baseline, threshold=0.5)), 8)
+        self.assertEqual(BenchmarkSuite.compare({'cases': cases}, {'cases': cases}), [])
+
+        warm, cold = suite.generate_sound_cases()
+        beat1, beat2 = GenerateBeat(1, seed=suite.seed).generate_sound()
+        self.assertEqual(warm['audio_seconds'], (len(beat1) + len(beat2)) / suite.sample_rate)
+        self.assertEqual(cold['audio_seconds'], warm['audio_seconds'])
+
+
+class TestRenderProfile(unittest.TestCase):
+    def test_records_stages_only_while_active(self):
+        self.assertIs(span('mixing'), NULL_SPAN)
+
+        with RenderProfile() as profile:
+            generate_beat = GenerateBeat(repetition=2, voice_bank=VoiceBank())
+            beat, _ = generate_beat.generate_sound()
+            Reverb_apply.apply_reverb(beat, 100, 0.5, 0.1)
+        totals = profile.totals()
+        for stage in ('pattern', 'synthesis', 'panning', 'mixing', 'tiling', 'reverb'):
+            self.assertIn(stage, totals)
+        self.assertEqual(totals['reverb']['samples'], len(beat))
+        # Each of the two sequencers copies its first cycle over the second one.
+        self.assertEqual(totals['tiling']['samples'], len(beat))
+        self.assertIn('synthesis', profile.summary())
+        self.assertGreater(totals['mixing']['nbytes'], 0)
+
+        with tempfile.TemporaryDirectory() as directory, RenderProfile() as export_profile:
+            write_chunks(os.path.join(directory, 'beat.wav'), [beat[:1000], beat[1000:]])
+        export_totals = export_profile.totals()
+        self.assertEqual((export_totals['int16']['samples'], export_totals['int16']['count']), (len(beat), 2))
+        self.assertEqual(export_totals['write']['nbytes'], beat.size * 2)
+
+        GenerateBeat(repetition=2).generate_sound()
+        self.assertEqual(len(profile.spans), sum(total['count'] for total in totals.values()))
+
+    def test_records_a_full_render_across_threads(self):
+        with RenderProfile() as profile:
+            RenderQueue().render('reverb')
+        # Synthesis is only recorded when the shared voice bank is cold.
+        self.assertLessEqual({'pattern', 'mixing', 'panning', 'tiling', 'reverb'}, set(profile.totals()))
+
+        with RenderProfile() as profile:
+            GenerateBeat(repetition=2, seed=0, voice_seed=0, workers=2, voice_bank=VoiceBank()).generate_sound()
+        self.assertEqual(profile.totals()['synthesis']['count'], len(GenerateBeat.kit))
+        self.assertEqual(span('mixing'), NULL_SPAN)
+
+
+class TestRenderQueue(unittest.TestCase):
+    def wait_for(self, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_fills_queues_and_refills_after_get(self):
+        render_queue = RenderQueue(depth=1, repetition=1)
+        render_queue.start()
+        try:
+            self.wait_for(lambda: all(render_queue.queued().values()))
+            sequencer = render_queue.get('reverb')
+            self.assertEqual(render_queue.queued()['reverb'], 0)
+            self.assertEqual(sequencer.render().dtype, np.float32)
+            self.wait_for(lambda: render_queue.queued()['reverb'] == 1)
+        finally:
+            render_queue.stop()
+        self.assertEqual(render_queue.threads, [])
+        self.assertEqual((render_queue.nbytes, sum(render_queue.queued().values())), (0, 0))
+
+    def test_memory_budget(self):
+        render_queue = RenderQueue(depth=4, max_bytes=1, repetition=1)
+        sequencer = render_queue.sequence('reverb')
+        self.assertEqual(render_queue.beat_bytes(sequencer), render_queue.render_sequencer('reverb', sequencer).nbytes)
+
+        renders = []
+        render_sequencer = render_queue.render_sequencer
+        render_queue.render_sequencer = lambda *args: renders.append(args) or render_sequencer(*args)
+        render_queue.start()
+        try:
+            time.sleep(0.2)
+            self.assertEqual(render_queue.nbytes, 0)
+            # Beats over the budget are not rendered at all.
+            self.assertEqual(renders, [])
+            # An empty queue renders in the caller.
+            self.assertEqual(render_queue.get('groove').steps, 1)
+        finally:
+            render_queue.stop()
+
+
+class TestBeatMaker(unittest.TestCase):
+    def test_runs_in_process_with_voice_arrays(self):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+
+        bank = VoiceBank()
+        kit = [bank.get(instrument, params, 150, seed=0) for _, instrument, params in SoundFile.sounds]
+        voices, labels = kit_rows(kit, sound_names, 8)
+        self.assertEqual(labels[6:], ['Kick 2', 'Snare 2'])
+        self.assertIs(voices[6], kit[0])
+
+        engine = StreamEngine(stream_factory=NullStream)
+        beat_maker = BeatMaker(voices, labels, beats=4, engine=engine)
+        beat_maker.open()
+        try:
+            self.assertIsNone(beat_maker.cell_at((0, 0)))
+            cell = beat_maker.cell_rect(2, 7).center
+            beat_maker.handle_event(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=cell, button=1))
+            self.assertTrue(beat_maker.clicked.hits[7, 2])
+            self.assertEqual(len(beat_maker.make_sequencer().tracks), 1)
+            engine.stream.pull(4)
+            beat_maker.handle_event(pygame.event.Event(pygame.QUIT))
+            self.assertFalse(beat_maker.running)
+        finally:
+            beat_maker.close()
+
+        with self.assertRaises(ValueError):
+            BeatMaker(voices * 100, labels * 100)
+
+    def test_premixes_columns(self):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+
+        bank = VoiceBank()
+        voices = [bank.get(instrument, params, 150, seed=0) for _, instrument, params in SoundFile.sounds]
+        engine = StreamEngine(stream_factory=NullStream)
+        beat_maker = BeatMaker(voices, sound_names, beats=4, engine=engine)
+        beat_maker.open()
+        try:
+            for row in range(len(voices)):
+                cell = beat_maker.cell_rect(1, row).center
+                beat_maker.handle_event(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=cell, button=1))
+            self.assertIsNone(beat_maker.columns[0])
+            self.assertEqual(len(beat_maker.make_sequencer().tracks), 1)
+
+            expected = np.zeros((max(len(voice) for voice in voices), 2), dtype=np.float32)
+            for voice, level in zip(voices, beat_maker.bus.matrix):
+                expected[:len(voice)] += voice[:, np.newaxis] * level
+            np.testing.assert_allclose(beat_maker.columns[1], expected, atol=1e-5)
+
+            beat_maker.handle_event(pygame.event.Event(pygame.MOUSEBUTTONDOWN,
+                                                       pos=beat_maker.cell_rect(1, 0).center, button=1))
+            expected[:len(voices[0])] -= voices[0][:, np.newaxis] * beat_maker.bus.matrix[0]
+            np.testing.assert_allclose(beat_maker.columns[1], expected, atol=1e-5)
+
+            # Solo a row and the cached column and the loop follow the bus.
+            beat_maker.bus.solo(2)
+            solo = np.zeros_like(expected)
+            solo[:len(voices[2])] = voices[2][:, np.newaxis] * beat_maker.bus.matrix[2]
+            np.testing.assert_allclose(beat_maker.columns[1], solo, atol=1e-5)
+            engine.stream.pull(1)
+            np.testing.assert_allclose(engine.tracks[0][0], solo, atol=1e-5)
+        finally:
+            beat_maker.close()
+
 
 if __name__ == '__main__':
     unittest.main()